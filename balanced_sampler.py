@@ -0,0 +1,134 @@
+# balanced_sampler.py
+# 基于下标的类别均衡采样：标签极度不均衡（ads Excellent 11 条 vs Fair 199,086 条），
+# 不再复制行或物理过采样，而是：
+# - builder 在每个 split 目录下写 class_index.npz：每个 (question_type, answer) 对应的行号数组
+# - BalancedSampler 用别名法（Vose alias）O(1) 选类别，再在该类行号里 O(1) 均匀取一个
+# 可以直接作为 torch DataLoader 的 sampler（实现了 __iter__ / __len__）。
+import os
+import json
+
+import numpy as np
+
+CLASS_INDEX_NAME = "class_index.npz"
+_SEP = "__"
+
+
+def class_key(question_type, answer):
+    return f"{question_type}{_SEP}{answer}"
+
+
+def split_class_key(key):
+    qt, _, ans = key.partition(_SEP)
+    return qt, ans
+
+
+def build_class_index(solutions):
+    """solution 列（JSON 字符串，含 answer / answer_type）→ {class_key: int64 行号数组}。"""
+    groups = {}
+    for row, sol in enumerate(solutions):
+        obj = json.loads(sol)
+        groups.setdefault(class_key(obj.get("answer_type"), obj.get("answer")), []).append(row)
+    return {k: np.asarray(v, dtype=np.int64) for k, v in groups.items()}
+
+
+def save_class_index(index, split_dir):
+    path = os.path.join(split_dir, CLASS_INDEX_NAME)
+    np.savez(path, **index)
+    return path
+
+
+def load_class_index(split_dir):
+    with np.load(os.path.join(split_dir, CLASS_INDEX_NAME)) as z:
+        return {k: z[k] for k in z.files}
+
+
+def write_class_index_for_dataset(dataset, split_dir):
+    """从已保存的数据集读取 solution 列（不解码图片）生成并保存 class_index.npz。"""
+    return save_class_index(build_class_index(dataset["solution"]), split_dir)
+
+
+def _alias_table(probs):
+    """Vose 别名表：O(K) 构建，O(1) 采样。"""
+    k = len(probs)
+    scaled = np.asarray(probs, dtype=np.float64) * k
+    prob = np.zeros(k)
+    alias = np.zeros(k, dtype=np.int64)
+    small = [i for i in range(k) if scaled[i] < 1.0]
+    large = [i for i in range(k) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+class BalancedSampler:
+    """
+    按类别温度采样：p_c ∝ n_c ** (1 / temperature)
+    - temperature=1: 按原始频率（等价于普通随机采样）
+    - temperature=None / inf: 各类等概率（完全均衡）
+    - class_weights: 直接给定 {class_key: 权重}，优先于 temperature
+    每次抽取先按别名表选类，再在类内均匀选行号，整体 O(1)，不复制任何数据。
+    """
+
+    def __init__(self, class_index, temperature=None, class_weights=None, num_samples=None, seed=2025,
+                 question_type=None):
+        keys = sorted(k for k, v in class_index.items()
+                      if len(v) and (question_type is None or split_class_key(k)[0] == question_type))
+        if not keys:
+            raise ValueError("No non-empty classes to sample from.")
+        self.keys = keys
+        sizes = np.array([len(class_index[k]) for k in keys], dtype=np.int64)
+        self.flat = np.concatenate([class_index[k] for k in keys])
+        self.starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self.sizes = sizes
+
+        if class_weights is not None:
+            w = np.array([float(class_weights.get(k, 0.0)) for k in keys])
+        elif temperature is None or np.isinf(temperature):
+            w = np.ones(len(keys))
+        else:
+            w = sizes.astype(np.float64) ** (1.0 / temperature)
+        if w.sum() <= 0:
+            raise ValueError("Class weights sum to zero.")
+        self.probs = w / w.sum()
+        self._prob, self._alias = _alias_table(self.probs)
+
+        self.num_samples = int(num_samples) if num_samples is not None else int(sizes.sum())
+        self.seed = seed
+        self.epoch = 0
+
+    @classmethod
+    def from_split_dir(cls, split_dir, **kwargs):
+        return cls(load_class_index(split_dir), **kwargs)
+
+    def set_epoch(self, epoch):
+        """分布式/多 epoch 训练时每个 epoch 调一次，保证可复现又不重复。"""
+        self.epoch = epoch
+
+    def sample(self, n, rng):
+        """向量化抽取 n 个行号。"""
+        u = rng.random(n) * len(self.keys)
+        cls = u.astype(np.int64)
+        cls = np.where(u - cls < self._prob[cls], cls, self._alias[cls])
+        offset = (rng.random(n) * self.sizes[cls]).astype(np.int64)
+        return self.flat[self.starts[cls] + offset]
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        remaining = self.num_samples
+        while remaining > 0:
+            n = min(remaining, 65536)
+            yield from self.sample(n, rng).tolist()
+            remaining -= n
+
+    def __len__(self):
+        return self.num_samples
+
+    def describe(self):
+        """{class_key: (样本数, 抽样概率)}，便于检查温度设置。"""
+        return {k: (int(n), round(float(p), 6)) for k, n, p in zip(self.keys, self.sizes, self.probs)}
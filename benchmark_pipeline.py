@@ -0,0 +1,244 @@
+# benchmark_pipeline.py
+# 数据流水线的可复现基准：在本地合成一套语料（随机 PNG/JPEG 广告图、step1 JSON、带真实标签倾斜的 QA 列表），
+# 以子进程方式端到端运行 qa_generation.py / file_copy.py / dataset_generation.py，
+# 报告 items/s、峰值 RSS（经由一个极小的启动进程 wait4 拿到的工具进程及其 worker 的 ru_maxrss）和写出字节数。
+# 不需要生产数据；同样的参数 + seed 合成出同样的语料（已存在且参数一致时直接复用）。
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import subprocess
+
+from qa_generation import make_qa_pair
+from qa_records import write_json_list
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 线上标签计数（part/read.txt 的 AES / ADS 评分统计），直接作为抽样权重
+LABEL_SKEW = {
+    "aes": {"Fair": 191008, "Poor": 41786, "Good": 7579, "Bad": 2859, "Excellent": 2925},
+    "ads": {"Fair": 199086, "Poor": 29970, "Bad": 9316, "Good": 7774, "Excellent": 11},
+}
+# 常见广告尺寸 (height, width)
+AD_SIZES = [(1920, 1080), (1334, 750), (800, 800), (628, 1200), (1080, 1080), (1280, 720)]
+
+TOOLS = ["qa_generation", "qa_generation_jsonl", "file_copy", "dataset_generation"]
+
+
+def _draw_ad(rng, height, width):
+    """渐变底 + 若干色块 + 轻微噪声，压缩率接近真实广告图（纯随机噪声会让 PNG 大得离谱）。"""
+    import cv2
+    import numpy as np
+
+    nrng = np.random.default_rng(rng.getrandbits(32))
+    c0, c1 = nrng.integers(0, 256, 3), nrng.integers(0, 256, 3)
+    t = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    # broadcast_to 出来的是 0 步长视图，cv2 要求连续内存
+    image = np.ascontiguousarray(np.broadcast_to(c0 * (1 - t) + c1 * t, (height, width, 3)), dtype=np.uint8)
+    for _ in range(rng.randint(3, 10)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randint(40, width // 2)), min(height, y0 + rng.randint(40, height // 2))
+        color = tuple(int(c) for c in nrng.integers(0, 256, 3))
+        cv2.rectangle(image, (x0, y0), (x1, y1), color, thickness=-1)
+    noise = nrng.integers(-6, 7, image.shape, dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthesize_corpus(root, num_images, seed=2025, jpeg_ratio=0.5):
+    """
+    root/images/*.png|jpg, root/step1/{image_id}.json（与 convert_raw_annotations 的逐文件格式相同），
+    root/qa.json（make_qa_pair 生成，JSON 数组 indent=2）。返回 manifest。
+    """
+    import cv2
+
+    params = {"num_images": num_images, "seed": seed, "jpeg_ratio": jpeg_ratio}
+    manifest_path = os.path.join(root, "manifest.json")
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params:
+            print(f"♻️ 复用已合成的语料: {root}")
+            return manifest
+    shutil.rmtree(root, ignore_errors=True)
+    image_dir, step1_dir = os.path.join(root, "images"), os.path.join(root, "step1")
+    os.makedirs(image_dir)
+    os.makedirs(step1_dir)
+
+    rng = random.Random(seed)
+    labels = {qt: (list(w), list(w.values())) for qt, w in LABEL_SKEW.items()}
+    qas = []
+    t0 = time.perf_counter()
+    for i in range(num_images):
+        height, width = rng.choice(AD_SIZES)
+        image_id = f"ad_{i:07d}"
+        if rng.random() < jpeg_ratio:
+            path = os.path.join(image_dir, image_id + ".jpg")
+            cv2.imwrite(path, _draw_ad(rng, height, width), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        else:
+            path = os.path.join(image_dir, image_id + ".png")
+            cv2.imwrite(path, _draw_ad(rng, height, width))
+        record = {
+            "id": i,
+            "image_id": image_id,
+            "aes_score": rng.choices(*labels["aes"])[0],
+            "ads_score": rng.choices(*labels["ads"])[0],
+            "file_path": path,
+        }
+        with open(os.path.join(step1_dir, f"{image_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        qas.extend(make_qa_pair(record, rng))
+    with open(os.path.join(root, "qa.json"), "w", encoding="utf-8") as f:
+        write_json_list(qas, f, indent=2)
+
+    manifest = {"params": params, "images": num_images, "qa_items": len(qas),
+                "image_bytes": dir_bytes(image_dir), "synth_seconds": round(time.perf_counter() - t0, 2)}
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    print(f"✅ 合成 {num_images} 张图 / {len(qas)} 条 QA → {root}（{manifest['synth_seconds']}s）")
+    return manifest
+
+
+def dir_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+# 极小的启动进程：由它 fork + exec 工具并 wait4。直接从本进程 fork 的话，子进程的 ru_maxrss
+# 会继承本进程（已加载 numpy / cv2、合成过图片）的 RSS 高水位，测到的是基准脚本自己的内存。
+_LAUNCHER = (
+    "import os, sys, json, subprocess\n"
+    "proc = subprocess.Popen(sys.argv[2:])\n"
+    "_, status, usage = os.wait4(proc.pid, 0)\n"
+    "with open(sys.argv[1], 'w') as f:\n"
+    "    json.dump({'maxrss_kb': usage.ru_maxrss}, f)\n"
+    "sys.exit(os.waitstatus_to_exitcode(status) & 0xFF)\n"
+)
+
+
+def run_tool(name, cmd, outputs, items, log_path):
+    """运行一个工具并等待；峰值 RSS 只统计工具进程（含它等待过的 worker），由启动进程回报。"""
+    for out in outputs:
+        if os.path.isdir(out):
+            shutil.rmtree(out)
+        elif os.path.isfile(out):
+            os.remove(out)
+    rusage_path = log_path + ".rusage.json"
+    with open(log_path, "w", encoding="utf-8") as log:
+        t0 = time.perf_counter()
+        returncode = subprocess.call([sys.executable, "-S", "-c", _LAUNCHER, rusage_path] + cmd, cwd=HERE,
+                                     stdout=log, stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - t0
+    maxrss_kb = None
+    if os.path.isfile(rusage_path):
+        with open(rusage_path, "r", encoding="utf-8") as f:
+            maxrss_kb = json.load(f)["maxrss_kb"]
+        os.remove(rusage_path)
+    written = sum(dir_bytes(out) for out in outputs if os.path.exists(out))
+    return {
+        "tool": name,
+        "ok": returncode == 0,
+        "items": items,
+        "seconds": round(seconds, 3),
+        "items_per_s": round(items / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(maxrss_kb / 1024, 1) if maxrss_kb is not None else None,  # Linux 上 ru_maxrss 单位是 KB
+        "bytes_written": written,
+        "log": log_path,
+    }
+
+
+def tool_commands(corpus, out_dir, manifest, args):
+    """name -> (命令, 输出路径列表, 输入条目数)。"""
+    py = sys.executable
+    step1, qa = os.path.join(corpus, "step1"), os.path.join(corpus, "qa.json")
+    n_img, n_qa = manifest["images"], manifest["qa_items"]
+    timing = lambda name: ["--timing-report", os.path.join(out_dir, f"{name}.timing.json")]
+    return {
+        "qa_generation": ([py, "qa_generation.py", "--input", step1, "--output", os.path.join(out_dir, "qa_dataset.json")]
+                          + timing("qa_generation"),
+                          [os.path.join(out_dir, "qa_dataset.json")], n_img),
+        "qa_generation_jsonl": ([py, "qa_generation.py", "--input", step1, "--jsonl", "--workers", str(args.workers),
+                                 "--output", os.path.join(out_dir, "qa_dataset.jsonl")] + timing("qa_generation_jsonl"),
+                                [os.path.join(out_dir, "qa_dataset.jsonl")], n_img),
+        "file_copy": ([py, "file_copy.py", "--json", qa, "--out-root", os.path.join(out_dir, "subset"),
+                       "--per-class", str(args.per_class), "--out-json", os.path.join(out_dir, "qa_subset.json")]
+                      + timing("file_copy"),
+                      [os.path.join(out_dir, "subset"), os.path.join(out_dir, "qa_subset.json")], n_qa),
+        "dataset_generation": ([py, "dataset_generation.py", "--json", qa, "--output-base", os.path.join(out_dir, "dataset"),
+                                "--resize-hw", str(args.resize_hw), "--output-mode", args.output_mode]
+                               + timing("dataset_generation"),
+                               [os.path.join(out_dir, "dataset")], n_qa),
+    }
+
+
+def format_results(results):
+    lines = ["{:<22} {:>4} {:>8} {:>10} {:>10} {:>12} {:>12}".format(
+        "tool", "ok", "items", "seconds", "items/s", "peak_rss_mb", "written_mb")]
+    for r in results:
+        lines.append("{:<22} {:>4} {:>8} {:>10.2f} {:>10} {:>12} {:>12.1f}".format(
+            r["tool"], "✅" if r["ok"] else "❌", r["items"], r["seconds"], r["items_per_s"], r["peak_rss_mb"],
+            r["bytes_written"] / 2 ** 20))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthesize a local corpus and benchmark the pipeline tools end to end.")
+    parser.add_argument("--work-dir", default=".bench", help="Corpus and tool outputs go here")
+    parser.add_argument("--num-images", type=int, default=2000, help="Synthetic ads to generate (2 QA items each)")
+    parser.add_argument("--jpeg-ratio", type=float, default=0.5, help="Fraction of images written as JPEG (rest PNG)")
+    parser.add_argument("--seed", type=int, default=2025)
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=TOOLS)
+    parser.add_argument("--workers", type=int, default=4, help="--workers for qa_generation --jsonl")
+    parser.add_argument("--per-class", type=int, default=2000, help="--per-class for file_copy")
+    parser.add_argument("--resize-hw", type=int, default=256, help="--resize-hw for dataset_generation")
+    parser.add_argument("--output-mode", choices=["image", "lazy", "tensor"], default="image",
+                        help="--output-mode for dataset_generation")
+    parser.add_argument("--out-json", default=None, help="Also write results (with per-stage timings) to this JSON file")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Quick end-to-end check: 20 images at 64px under <work-dir>/smoke; exits non-zero if any tool fails")
+    args = parser.parse_args()
+    if args.smoke:
+        args.work_dir = os.path.join(args.work_dir, "smoke")
+        args.num_images, args.resize_hw = 20, 64
+
+    corpus = os.path.abspath(os.path.join(args.work_dir, "corpus"))
+    out_dir = os.path.abspath(os.path.join(args.work_dir, "out"))
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = synthesize_corpus(corpus, args.num_images, seed=args.seed, jpeg_ratio=args.jpeg_ratio)
+
+    commands = tool_commands(corpus, out_dir, manifest, args)
+    results = []
+    for name in args.tools:
+        cmd, outputs, items = commands[name]
+        print(f"▶️ {name} ...")
+        timing_path = os.path.join(out_dir, f"{name}.timing.json")
+        if os.path.isfile(timing_path):
+            os.remove(timing_path)
+        result = run_tool(name, cmd, outputs, items, os.path.join(out_dir, f"{name}.log"))
+        if os.path.isfile(timing_path):
+            with open(timing_path, "r", encoding="utf-8") as f:
+                result["timing"] = json.load(f)
+        if not result["ok"]:
+            print(f"❌ {name} 失败，见日志: {result['log']}")
+        results.append(result)
+
+    print("\n===== Benchmark =====")
+    print(f"Corpus: {corpus}  ({manifest['images']} images, {manifest['qa_items']} QA items, "
+          f"{manifest['image_bytes'] / 2 ** 20:.1f} MB)")
+    print(format_results(results))
+    if args.out_json:
+        with open(args.out_json, "w", encoding="utf-8") as f:
+            json.dump({"manifest": manifest, "results": results}, f, ensure_ascii=False, indent=2)
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
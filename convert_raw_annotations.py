@@ -0,0 +1,178 @@
+# convert_raw_annotations.py
+# 原始标注（见 part/read.txt）是一个以文件名为 key 的大 JSON 对象，每张图 5 个 Aesthetic_scoring
+# 和 5 个 Ad_attribute 投票。这里流式读取该对象，按批用 NumPy 计算共识标签和一致度，
+# 改写 Windows file_path，直接写出 step1 记录（逐文件目录或 step1_store 打包存储）。
+import os
+import json
+import argparse
+from pathlib import PureWindowsPath, PurePosixPath
+from collections import Counter
+
+import numpy as np
+
+from json_stream import iter_json_object_items
+from step1_store import Step1PackWriter
+
+# 5 级评分（ITU 5 级量表顺序：Bad < Poor < Fair < Good < Excellent）
+LABELS = ["Bad", "Poor", "Fair", "Good", "Excellent"]
+LABEL2CODE = {lab: i for i, lab in enumerate(LABELS)}
+NUM_VOTES = 5
+
+
+def encode_votes(vote_lists):
+    """投票列表 → (B, NUM_VOTES) int8 编码矩阵，缺失/非法标签为 -1。"""
+    mat = np.full((len(vote_lists), NUM_VOTES), -1, dtype=np.int8)
+    for i, votes in enumerate(vote_lists):
+        for j, v in enumerate((votes or [])[:NUM_VOTES]):
+            mat[i, j] = LABEL2CODE.get(str(v).strip().capitalize(), -1)
+    return mat
+
+
+def consensus(mat):
+    """
+    向量化多数投票：
+    - counts: (B, L) 每个标签票数
+    - label: 票数最多的标签；平票时取离投票中位数最近的那个（仍平则取较低档）
+    - agreement: 共识标签票数 / 有效票数
+    无有效票的行 label=-1, agreement=0。
+    """
+    n_labels = len(LABELS)
+    valid = mat >= 0
+    counts = (mat[:, :, None] == np.arange(n_labels)[None, None, :]).sum(axis=1)
+    n_valid = valid.sum(axis=1)
+
+    # 中位数（忽略 -1）：把缺失票置为 nan 后取 nanmedian
+    votes_f = np.where(valid, mat, np.nan).astype(np.float32)
+    with np.errstate(all="ignore"):
+        has_votes = n_valid > 0
+        median = np.zeros(len(mat), dtype=np.float32)
+        if has_votes.any():
+            median[has_votes] = np.nanmedian(votes_f[has_votes], axis=1)
+
+    # 票数为主键，离中位数的距离为次键（距离 < 1 档 * n_labels 的缩放保证不会越过票数）
+    dist = np.abs(np.arange(n_labels)[None, :] - median[:, None])
+    score = counts * (2 * n_labels) - dist
+    label = score.argmax(axis=1).astype(np.int8)
+    top = counts[np.arange(len(mat)), label]
+
+    label[~has_votes] = -1
+    agreement = np.where(has_votes, top / np.maximum(n_valid, 1), 0.0)
+    return label, agreement, counts
+
+
+def rewrite_file_path(fp, new_root, keep_parts=2):
+    """
+    D:\\01 work\\...\\0322-round3\\xxx.png → {new_root}/0322-round3/xxx.png
+    只保留最后 keep_parts 段（默认：批次目录 + 文件名）。
+    """
+    if not fp or not new_root:
+        return fp
+    parts = PureWindowsPath(fp).parts if "\\" in fp else PurePosixPath(fp).parts
+    return str(PurePosixPath(new_root, *parts[-keep_parts:]))
+
+
+def _flush(batch, sink, stats, start_id, new_root, keep_parts):
+    names = [name for name, _ in batch]
+    aes_mat = encode_votes([v.get("Aesthetic_scoring") for _, v in batch])
+    ads_mat = encode_votes([v.get("Ad_attribute") for _, v in batch])
+    aes_label, aes_agree, _ = consensus(aes_mat)
+    ads_label, ads_agree, _ = consensus(ads_mat)
+
+    # 只有两项都有有效票的图才写出
+    ok = (aes_label >= 0) & (ads_label >= 0)
+    stats["skipped"] += int((~ok).sum())
+    stats["aes"].update(LABELS[c] for c in aes_label[ok])
+    stats["ads"].update(LABELS[c] for c in ads_label[ok])
+    stats["aes_unanimous"] += int((aes_agree[ok] == 1.0).sum())
+    stats["ads_unanimous"] += int((ads_agree[ok] == 1.0).sum())
+    stats["aes_agreement_sum"] += float(aes_agree[ok].sum())
+    stats["ads_agreement_sum"] += float(ads_agree[ok].sum())
+
+    next_id = start_id
+    for i in np.flatnonzero(ok):
+        raw = batch[i][1]
+        sink.write({
+            "id": next_id,
+            "image_id": names[i],
+            "aes_score": LABELS[aes_label[i]],
+            "ads_score": LABELS[ads_label[i]],
+            "file_path": rewrite_file_path(raw.get("file_path"), new_root, keep_parts),
+            "Aesthetic_scoring": raw.get("Aesthetic_scoring"),
+            "Ad_attribute": raw.get("Ad_attribute"),
+            "aes_agreement": round(float(aes_agree[i]), 4),
+            "ads_agreement": round(float(ads_agree[i]), 4),
+        })
+        next_id += 1
+    return next_id
+
+
+class _DirSink:
+    """按原 step1 格式：每张图一个 JSON 文件。"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, record):
+        with open(os.path.join(self.output_dir, f"{record['image_id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def convert(raw_json, output_dir, new_root=None, keep_parts=2, start_id=0, batch_size=8192, packed=False,
+            records_per_shard=50000):
+    """流式转换原始标注 → step1 记录，返回统计信息。"""
+    sink = Step1PackWriter(output_dir, records_per_shard) if packed else _DirSink(output_dir)
+    stats = {"aes": Counter(), "ads": Counter(), "skipped": 0,
+             "aes_unanimous": 0, "ads_unanimous": 0, "aes_agreement_sum": 0.0, "ads_agreement_sum": 0.0}
+    next_id = start_id
+    batch = []
+    try:
+        for name, value in iter_json_object_items(raw_json):
+            batch.append((name, value))
+            if len(batch) >= batch_size:
+                next_id = _flush(batch, sink, stats, next_id, new_root, keep_parts)
+                batch = []
+        if batch:
+            next_id = _flush(batch, sink, stats, next_id, new_root, keep_parts)
+    except BaseException:
+        # 中断 / 出错：打包存储不写 index.json（is_packed_store 不会把半成品当成完整存储）
+        sink.abort()
+        raise
+    sink.close()
+    stats["written"] = next_id - start_id
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the raw annotation JSON into step1 records with vectorized majority vote.")
+    parser.add_argument("--raw-json", required=True, help="Raw annotation JSON (object keyed by filename)")
+    parser.add_argument("--output-dir", default="step1", help="Output step1 directory (or packed store with --packed)")
+    parser.add_argument("--new-root", default=None, help="Rewrite file_path to <new-root>/<last --keep-parts components>")
+    parser.add_argument("--keep-parts", type=int, default=2, help="Trailing path components kept when rewriting file_path")
+    parser.add_argument("--start-id", type=int, default=0, help="First sequential id")
+    parser.add_argument("--batch-size", type=int, default=8192, help="Images per NumPy vote batch")
+    parser.add_argument("--packed", action="store_true", help="Write a step1_store packed store instead of per-image files")
+    args = parser.parse_args()
+
+    stats = convert(args.raw_json, args.output_dir, new_root=args.new_root, keep_parts=args.keep_parts,
+                    start_id=args.start_id, batch_size=args.batch_size, packed=args.packed)
+
+    n = max(stats["written"], 1)
+    print("\n📊 总 AES 评分统计:")
+    print(dict(stats["aes"].most_common()))
+    print("\n📊 总 ADS 评分统计:")
+    print(dict(stats["ads"].most_common()))
+    print("\n===== Summary =====")
+    print(f"Written: {stats['written']}  Skipped (no valid votes): {stats['skipped']}")
+    print(f"AES mean agreement: {stats['aes_agreement_sum'] / n:.4f}  unanimous: {stats['aes_unanimous']}")
+    print(f"ADS mean agreement: {stats['ads_agreement_sum'] / n:.4f}  unanimous: {stats['ads_unanimous']}")
+
+
+if __name__ == "__main__":
+    main()
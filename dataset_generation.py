@@ -1,25 +1,42 @@
 import os
 import json
 import random
-import cv2
+import argparse
 from tqdm import tqdm
 from collections import defaultdict
-from datasets import Dataset, DatasetDict, Features, Value, Image
+from datasets import ClassLabel, Dataset, DatasetDict, Features, Value, Image, load_from_disk
+from datasets.arrow_writer import ArrowWriter
 
-def create_local_dataset(train_data, output_dir):
+from balanced_sampler import write_class_index_for_dataset
+from image_pipeline import iter_processed_images
+from lazy_dataset import LAZY_FEATURES, build_lazy_columns
+from near_dup import DEFAULT_MAX_DISTANCE, compute_hashes, dedup_groups, load_hashes, save_hashes, split_for_group
+from pipeline_timing import NULL_TIMER, make_timer
+from prompts import PromptTable
+from qa_generation import QUESTION_TEMPLATES
+from qa_records import load_qa_records
+from shard_checkpoint import build_split_checkpointed, items_fingerprint, publish_arrow_files
+from sharding import add_shard_args, check_shard_args, in_shard, shard_suffix
+from tensor_store import DEFAULT_ROWS_PER_FILE, TENSOR_FEATURES, write_tensor_split
+from verify_images import BadImageList
+
+FEATURES = Features({
+    'id': Value('string'),
+    'problem': Value('string'),
+    'solution': Value('string'),
+    'image': Image(),
+    'img_height': Value('int64'),
+    'img_width': Value('int64'),
+    'resized_height': Value('int64'),
+    'resized_width': Value('int64')
+})
+
+def create_local_dataset(train_data, output_dir, features=FEATURES):
+    # features=LAZY_FEATURES: 只存 image_path，不存图片，用 lazy_dataset.load_lazy_dataset 加载
     dataset = DatasetDict({
         'train': Dataset.from_dict(
             train_data,
-            features=Features({
-                'id': Value('string'),
-                'problem': Value('string'),
-                'solution': Value('string'),
-                'image': Image(),
-                'img_height': Value('int64'),
-                'img_width': Value('int64'),
-                'resized_height': Value('int64'),
-                'resized_width': Value('int64')
-            })
+            features=features
         )
     })
     os.makedirs(output_dir, exist_ok=True)
@@ -27,6 +44,82 @@ def create_local_dataset(train_data, output_dir):
     print(f"✅ 数据集已保存到: {output_dir}")
     return dataset
 
+def with_question_ids(features, templates):
+    """--encode-templates：problem 列换成 question_id（ClassLabel），模板表只在数据集的 features 元数据里存一份。"""
+    return Features({('question_id' if k == 'problem' else k): (ClassLabel(names=list(templates)) if k == 'problem' else v)
+                     for k, v in features.items()})
+
+def encode_problems(examples, template2id):
+    """样本里的 problem 文本 → question_id（逐条）。"""
+    for example in examples:
+        yield {('question_id' if k == 'problem' else k): (template2id[v] if k == 'problem' else v)
+               for k, v in example.items()}
+
+def encode_image(image):
+    """与 Image().encode_example 相同的 PNG 编码 → {"path": None, "bytes": ...}；在解码线程里执行。"""
+    return FEATURES['image'].encode_example(image)
+
+def _write_arrow(examples, path, timer=NULL_TIMER, features=FEATURES):
+    """单写线程：图片已在解码线程编码成 PNG 字节，这里只追加 Arrow 行，返回行数。"""
+    with ArrowWriter(features=features, path=path) as writer:
+        for example in examples:
+            with timer.stage("arrow_write"):
+                writer.write(features.encode_example(example))
+        rows, _ = writer.finalize()
+    return rows
+
+def write_local_dataset(examples, output_dir, timer=NULL_TIMER, features=FEATURES):
+    """
+    流式版 create_local_dataset：逐条把样本编码写入 Arrow 文件（单写线程），
+    不在内存中攒整个 split 的图片；写完后把该文件改名成 DatasetDict 的数据文件（不再 save_to_disk 拷贝一遍），
+    结构与原来一致。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = os.path.join(output_dir, "_building.arrow")
+    _write_arrow(examples, tmp_path, timer, features)
+    publish_arrow_files([tmp_path], output_dir)
+    print(f"✅ 数据集已保存到: {output_dir}")
+    return load_from_disk(output_dir)
+
+def write_dataset_shard(examples, shard_path, timer=NULL_TIMER, features=FEATURES):
+    """写一个可续跑的分片（单个 Arrow 文件，写完才改名到 shard_path），返回行数。"""
+    os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+    tmp_path = shard_path + ".tmp"
+    rows = _write_arrow(examples, tmp_path, timer, features)
+    os.replace(tmp_path, shard_path)
+    return rows
+
+def iter_split_examples(split_items, resize_hw, desc, io_workers=8, decode_workers=None, queue_size=64,
+                        timer=NULL_TIMER, encode=encode_image):
+    """
+    读字节 / 解码缩放编码 / 写出三段重叠执行；产出 FEATURES 格式的样本，失败的样本打印后跳过。
+    encode=None 时 'image' 为缩放后的 uint8 数组（张量存储模式用）。
+    """
+    images = iter_processed_images(split_items, resize_hw, io_workers=io_workers, decode_workers=decode_workers,
+                                   queue_size=queue_size, timer=timer, encode=encode)
+    for res in tqdm(images, desc=desc, total=len(split_items)):
+        if res.error == "missing":
+            print(f"❌ 图片不存在: {res.path}")
+            continue
+        if res.error is not None:
+            print(f"❌ 读取失败: {res.path}")
+            continue
+        item = res.item
+        solution_obj = {
+            "answer": item.get('answer', None),
+            "answer_type": item.get('question_type', None)
+        }
+        yield {
+            'id': str(item.get('id', '')),
+            'problem': str(item.get('question', '')),
+            'solution': json.dumps(solution_obj, ensure_ascii=False),
+            'image': res.image,
+            'img_height': res.height,
+            'img_width': res.width,
+            'resized_height': resize_hw,
+            'resized_width': resize_hw
+        }
+
 def split_by_ratio(data_list, ratio=(8,1,1), seed=2025):
     random.Random(seed).shuffle(data_list)
     n = len(data_list)
@@ -40,22 +133,104 @@ def split_by_ratio(data_list, ratio=(8,1,1), seed=2025):
     }
 
 if __name__ == "__main__":
-    json_path = "panoramic_QA.json"      # 你的问答 json
-    output_base = "data/SegZero_panoramic_qa_split"
-    resize_hw = 768
-    debug = False #True
-    debug_n = 200
-
-    # 1. 加载数据并按 "question_type" & "answer" 二级分组
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # 2. 二级分组
-    group2list = defaultdict(list) # (question_type, answer) -> list
-    for item in data:
-        qtype = item.get('question_type', 'unknown')
-        answer = item.get('answer', 'unknown')  # 直接用 answer 分组
-        group2list[(qtype, answer)].append(item)
+    parser = argparse.ArgumentParser(description="Build train/val/test image QA datasets from a QA json.")
+    parser.add_argument("--json", default="panoramic_QA.json", help="你的问答 json（JSON 数组或 JSONL）")
+    parser.add_argument("--output-base", default="data/SegZero_panoramic_qa_split", help="Output root; one dataset per split")
+    parser.add_argument("--resize-hw", type=int, default=768, help="Square resize size")
+    parser.add_argument("--debug", action="store_true", help="Only sample --debug-n items per (question_type, answer)")
+    parser.add_argument("--debug-n", type=int, default=200)
+    parser.add_argument("--bad-list", default=None, help="Exclusion list from verify_images.py; listed images are skipped up front")
+    parser.add_argument("--timing-report", default=None, help="Write per-stage timing report (JSON) to this path")
+    parser.add_argument("--output-mode", choices=["image", "lazy", "tensor"], default="image",
+                        help="image: store resized images; lazy: store paths only, resize on access via lazy_dataset.load_lazy_dataset; "
+                             "tensor: raw uint8 images in memory-mapped .npy files, read with tensor_store.TensorImageDataset")
+    parser.add_argument("--rows-per-file", type=int, default=DEFAULT_ROWS_PER_FILE, help="Images per .npy file in tensor mode")
+    parser.add_argument("--encode-templates", action="store_true",
+                        help="Store question_id (ClassLabel over the template table) instead of the problem text; "
+                             "read with qa_records.with_problem_column to get 'problem' back on access")
+    parser.add_argument("--io-workers", type=int, default=8, help="Threads prefetching raw image bytes")
+    parser.add_argument("--decode-workers", type=int, default=None, help="Threads for decode + resize (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=64, help="Max images in flight between read, decode and write (backpressure)")
+    parser.add_argument("--dedup", choices=["off", "keep-one", "group-split"], default="off",
+                        help="Near-duplicate handling: keep one image per pHash group, or put whole groups into one split")
+    parser.add_argument("--phash-file", default="phash.json", help="pHash cache from near_dup.py (missing hashes are computed; required as-is with --num-shards > 1)")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE, help="Max pHash Hamming distance for near-duplicates")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Items per checkpointed shard (0: no checkpointing)")
+    parser.add_argument("--resume", action="store_true", help="Keep validated finished shards and continue from the first incomplete one")
+    add_shard_args(parser)
+    args = parser.parse_args()
+    check_shard_args(args)
+    timer = make_timer(args.timing_report)
+
+    json_path = args.json
+    output_base = args.output_base
+    if args.num_shards > 1:
+        # 多机分片：每个分片写到 output_base/shard-XXXXX-of-XXXXX/{split}，之后用 merge_shards.py 合并
+        output_base = f"{output_base}/{shard_suffix(args.num_shards, args.shard_index)}"
+    resize_hw = args.resize_hw
+    debug = args.debug
+    debug_n = args.debug_n
+
+    # 1. 加载数据（列式 QATable，每行是轻量的只读视图）并按 "question_type" & "answer" 二级分组
+    with timer.stage("json_parse"):
+        data = load_qa_records(json_path)
+
+    # 1.0 模板表：qa_generation 的固定模板在前（id 稳定），输入里其他问题排序后追加
+    templates = template2id = None
+    if args.encode_templates:
+        questions = set(data.vocab('question')[1:])
+        if 0 in data.codes['question']:
+            questions.add('')  # 缺失的问题按空串写入 problem
+        templates = QUESTION_TEMPLATES + sorted(questions - set(QUESTION_TEMPLATES))
+        template2id = {q: i for i, q in enumerate(templates)}
+
+    # 1.1 预扫描排除：verify_images.py 记录的缺失/损坏图片直接跳过
+    bad_list = BadImageList(args.bad_list) if args.bad_list else None
+    excluded = 0
+
+    # 2. 二级分组（按字典编码比较，直接用 answer 分组）
+    group2list = {} # (question_type, answer) -> list
+    for (qtype, answer), rows in data.group_rows('question_type', 'answer').items():
+        items = [data[row] for row in rows]
+        if args.num_shards > 1:
+            items = [item for item in items if in_shard(item.get('image_id'), args.num_shards, args.shard_index)]
+        if bad_list is not None:
+            kept = [item for item in items if not bad_list.is_bad(item.get('file_path'))]
+            excluded += len(items) - len(kept)
+            items = kept
+        group2list[(qtype or 'unknown', answer or 'unknown')] = items
+    if bad_list is not None:
+        print(f"⚠️ 排除列表跳过 {excluded} 条（{args.bad_list}）")
+
+    # 2.1 近重复分组（pHash）：keep-one 每组只保留代表图；group-split 整组进同一个 split
+    dup_group = {}
+    if args.dedup != "off":
+        # 分组基于全部条目（而不只是本分片），多机分片时各节点得到一致的组代表；
+        # 但先去掉排除列表里的坏图（各节点用同一份列表），否则坏图当了组代表，keep-one 会把整组有效图都丢掉
+        all_items = [item for item in data if bad_list is None or not bad_list.is_bad(item.get('file_path'))]
+        existing = load_hashes(args.phash_file) if os.path.isfile(args.phash_file) else {}
+        key2path = {item.get('image_id'): item.get('file_path') for item in all_items if item.get('image_id')}
+        if args.num_shards > 1:
+            # 多机分片：不在每个节点上重复哈希全量图片，只用预先算好的哈希文件（先跑一次 near_dup.py）
+            if not existing:
+                raise FileNotFoundError(f"--num-shards > 1 with --dedup needs a precomputed --phash-file "
+                                        f"(run near_dup.py --json {json_path} --hash-file {args.phash_file} first)")
+            missing = sum(1 for k in key2path if k not in existing)
+            if missing:
+                print(f"⚠️ {missing} 张图不在 {args.phash_file} 中，按各自独立成组处理")
+            hashes = existing
+        else:
+            hashes, _ = compute_hashes(key2path, workers=os.cpu_count() or 4, existing=existing)
+            if len(hashes) > len(existing):
+                save_hashes(hashes, args.phash_file)
+        dup_group = dedup_groups(all_items, hashes, args.max_distance)
+        if args.dedup == "keep-one":
+            dropped = 0
+            for key, items in group2list.items():
+                kept = [item for item in items if dup_group.get(item.get('image_id'), item.get('image_id')) == item.get('image_id')]
+                dropped += len(items) - len(kept)
+                group2list[key] = kept
+            print(f"⚠️ 近重复去重移除 {dropped} 条")
 
     # 3. 各组内做 train/val/test
     split_data_dict = {"train": [], "val": [], "test": []}
@@ -63,11 +238,18 @@ if __name__ == "__main__":
 
     for (qtype, answer), items in group2list.items():
         # 可选调试（只采样每类 debug_n 条）
-        items_ = random.sample(items, min(debug_n, len(items))) if debug and len(items) > debug_n else items
-        split_dict = split_by_ratio(items_, ratio=(8,1,1))
+        # 固定种子，保证 --resume 时各 split 的条目与上次完全一致
+        items_ = random.Random(2025).sample(items, min(debug_n, len(items))) if debug and len(items) > debug_n else items
+        if args.dedup == "group-split":
+            # 按近重复组代表的稳定哈希分 split，同组（含同图的 aes/ads 两行）不会跨 split
+            split_dict = {"train": [], "val": [], "test": []}
+            for item in items_:
+                image_id = item.get('image_id')
+                split_dict[split_for_group(dup_group.get(image_id, image_id), ratio=(8,1,1))].append(item)
+        else:
+            split_dict = split_by_ratio(items_, ratio=(8,1,1))
         for split, sublist in split_dict.items():
             for item in sublist:
-                item['split'] = split
                 split_data_dict[split].append(item)
                 split_count_dict[(qtype, answer)][split] += 1
 
@@ -78,48 +260,43 @@ if __name__ == "__main__":
             print(f"⚠️ split={split} 没有样本，跳过保存。")
             continue
 
-        id_list, problem_list, solution_list = [], [], []
-        image_list, img_height_list, img_width_list = [], [], []
-        resized_height_list, resized_width_list = [], []
-
-        for item in tqdm(split_items, desc=f"处理{split}", total=len(split_items)):
-            img_path = item.get('path') or item.get('image_path') or item.get('file_path')
-            if not img_path or not os.path.isfile(img_path):
-                print(f"❌ 图片不存在: {img_path}")
-                continue
-            image = cv2.imread(img_path)
-            if image is None:
-                print(f"❌ 读取失败: {img_path}")
-                continue
-            height, width = image.shape[:2]
-            resized_image = cv2.resize(image, (resize_hw, resize_hw), interpolation=cv2.INTER_AREA)
-
-            id_list.append(str(item.get('id', '')))
-            problem_list.append(str(item.get('question', '')))
-            solution_obj = {
-                "answer": item.get('answer', None),
-                "answer_type": item.get('question_type', None)
-            }
-            solution_list.append(json.dumps(solution_obj, ensure_ascii=False))
-            image_list.append(resized_image)
-            img_height_list.append(height)
-            img_width_list.append(width)
-            resized_height_list.append(resize_hw)
-            resized_width_list.append(resize_hw)
-
-        train_data = {
-            'id': id_list,
-            'problem': problem_list,
-            'solution': solution_list,
-            'image': image_list,
-            'img_height': img_height_list,
-            'img_width': img_width_list,
-            'resized_height': resized_height_list,
-            'resized_width': resized_width_list
-        }
-
         out_dir = f"{output_base}/{split}"
-        create_local_dataset(train_data=train_data, output_dir=out_dir)
+
+        def make_examples(items, desc=f"处理{split}", encode=encode_image):
+            examples = iter_split_examples(items, resize_hw, desc=desc, io_workers=args.io_workers,
+                                           decode_workers=args.decode_workers, queue_size=args.queue_size, timer=timer,
+                                           encode=encode)
+            return encode_problems(examples, template2id) if template2id else examples
+
+        def make_features(features):
+            return with_question_ids(features, templates) if template2id else features
+
+        if args.output_mode == "lazy":
+            # 只读图片头，秒级完成；不需要分片续跑
+            columns = build_lazy_columns(split_items, resize_hw, workers=args.io_workers)
+            if template2id:
+                columns = {('question_id' if k == 'problem' else k): ([template2id[p] for p in v] if k == 'problem' else v)
+                           for k, v in columns.items()}
+            dataset = create_local_dataset(columns, out_dir, features=make_features(LAZY_FEATURES))
+        elif args.output_mode == "tensor":
+            dataset = write_tensor_split(make_examples(split_items, encode=None), out_dir, resize_hw, total=len(split_items),
+                                         rows_per_file=args.rows_per_file, timer=timer,
+                                         features=make_features(TENSOR_FEATURES))
+        elif args.shard_size > 0:
+            # 分片写出 + 进度日志；崩溃后 --resume 从第一个未完成分片继续
+            fingerprint = items_fingerprint(split_items, resize_hw, args.encode_templates)
+            dataset = build_split_checkpointed(
+                split_items, out_dir,
+                write_shard=lambda items, shard_path: write_dataset_shard(make_examples(items), shard_path, timer,
+                                                                          make_features(FEATURES)),
+                shard_size=args.shard_size, fingerprint=fingerprint, resume=args.resume)
+        else:
+            dataset = write_local_dataset(make_examples(split_items), output_dir=out_dir, timer=timer,
+                                          features=make_features(FEATURES))
+        # 每个 (question_type, answer) 的行号数组，供 BalancedSampler 做均衡/温度采样（不复制数据）
+        write_class_index_for_dataset(dataset['train'], out_dir)
+        # prompt 表：共享前缀 / 后缀只存一份，模板 prompt 预渲染（下标与 question_id 一致）
+        PromptTable.from_template(templates=templates or QUESTION_TEMPLATES).save(out_dir)
 
     # 5. 打印每个question_type + answer等级在各split的数量
     print("\n=== 各 question_type + answer 等级的 train/val/test 数量 ===")
@@ -129,3 +306,6 @@ if __name__ == "__main__":
         tr, va, te = split_count_dict[(qtype, answer)]["train"], split_count_dict[(qtype, answer)]["val"], split_count_dict[(qtype, answer)]["test"]
         print("{:<12} {:<10} {:>6} {:>6} {:>6} {:>6}".format(qtype, answer, tr, va, te, tr+va+te))
     print("=============================================================")
+
+    if args.timing_report:
+        timer.write_report(args.timing_report, extra={"tool": "dataset_generation", "items": sum(len(v) for v in split_data_dict.values())})
@@ -3,6 +3,11 @@ import json, os, shutil, random, argparse
 from pathlib import Path
 from collections import defaultdict
 
+from pipeline_timing import make_timer
+from qa_records import load_qa_records, write_json_list
+from sharding import add_shard_args, check_shard_args, in_shard, shard_output_path, shard_quota
+from verify_images import BadImageList
+
 ALLOWED_QT = {"ads", "aes"}
 ALLOWED_ANS = ["Poor", "Bad", "Fair", "Good", "Excellent"]
 
@@ -40,9 +45,15 @@ def main():
     parser.add_argument("--json", required=True, help="Path to qa_datase.json")
     parser.add_argument("--out-root", default="./dataset", help="Output dataset root folder")
     parser.add_argument("--per-class", type=int, default=2000, help="Max samples per (question_type, answer)")
-    parser.add_argument("--out-json", default="qa_dataset_subset.json", help="Output JSON file path")
+    parser.add_argument("--out-json", default="qa_dataset_subset.json",
+                        help="Output JSON file path; with --num-shards > 1 the shard suffix is inserted before the extension")
     parser.add_argument("--seed", type=int, default=42, help="Random seed for sampling")
+    parser.add_argument("--bad-list", default=None, help="Exclusion list from verify_images.py; listed images are skipped")
+    parser.add_argument("--timing-report", default=None, help="Write per-stage timing report (JSON) to this path")
+    add_shard_args(parser)
     args = parser.parse_args()
+    check_shard_args(args)
+    timer = make_timer(args.timing_report)
 
     random.seed(args.seed)
 
@@ -50,17 +61,24 @@ def main():
     if not json_path.is_file():
         raise FileNotFoundError(f"JSON not found: {json_path}")
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    # 流式加载为紧凑的列式记录表（JSON 数组或 JSONL）
+    try:
+        with timer.stage("json_parse"):
+            data = load_qa_records(json_path)
+    except ValueError as e:
+        raise ValueError(f"Input JSON should be a list of QA items: {e}")
 
-    if not isinstance(data, list):
-        raise ValueError("Input JSON should be a list of QA items.")
+    bad_list = BadImageList(args.bad_list) if args.bad_list else None
 
-    # 1) 过滤出 ads/aes + 有效答案 + 可读图片路径
+    # 1) 过滤出 ads/aes + 有效答案 + 可读图片路径（排除列表中的坏图）
     buckets = defaultdict(list)  # (qt, ans) -> list of (item, src_path)
-    missing_img, skipped_qt, skipped_ans = 0, 0, 0
+    missing_img, skipped_qt, skipped_ans, skipped_bad = 0, 0, 0, 0
 
     for item in data:
+        # 多机分片：只处理 image_id 哈希落在本分片的条目
+        if not in_shard(get_key(item, "image_id", default=None), args.num_shards, args.shard_index):
+            continue
+
         qt = str(get_key(item, "question_type", "quetion_type", default="")).strip().lower()
         if qt not in ALLOWED_QT:
             skipped_qt += 1
@@ -72,7 +90,11 @@ def main():
             continue
 
         fp = get_key(item, "file_path", default=None)
-        src = resolve_image_path(fp, json_path)
+        if bad_list is not None and bad_list.is_bad(fp):
+            skipped_bad += 1
+            continue
+        with timer.stage("path_resolve"):
+            src = resolve_image_path(fp, json_path)
         if src is None:
             missing_img += 1
             continue
@@ -85,6 +107,8 @@ def main():
 
     output_records = []
     copy_fail = 0
+    # 分片运行时每类上限按分片均分，合并后总数仍不超过 --per-class
+    per_class = shard_quota(args.per_class, args.num_shards, args.shard_index)
 
     for qt in sorted(ALLOWED_QT):
         for ans in ALLOWED_ANS:
@@ -95,7 +119,7 @@ def main():
 
             # 随机打乱取上限
             random.shuffle(pairs)
-            chosen = pairs[: args.per_class]
+            chosen = pairs[: per_class]
 
             # 目标目录：dataset/qt/ans
             dst_dir = out_root / qt / ans
@@ -118,7 +142,8 @@ def main():
                     cnt += 1
 
                 try:
-                    shutil.copy2(src, dst_path)
+                    with timer.stage("copy"):
+                        shutil.copy2(src, dst_path)
                 except Exception as e:
                     copy_fail += 1
                     # 跳过复制失败的
@@ -139,9 +164,11 @@ def main():
             print(f"[OK] ({qt}, {ans}) 选取 {len(chosen)} / 可用 {len(pairs)} → 已复制到 {dst_dir}")
 
     # 3) 保存新 JSON
-    out_json = Path(args.out_json).resolve()
+    # 多机分片：每个分片写自己的 JSON，之后用 merge_shards.py json 合并
+    out_json = Path(shard_output_path(args.out_json, args.num_shards, args.shard_index)).resolve()
     with open(out_json, "w", encoding="utf-8") as f:
-        json.dump(output_records, f, ensure_ascii=False, indent=2)
+        # 格式与 json.dump(indent=2) 相同，每条记录记一次 write
+        write_json_list(output_records, f, indent=2, timer=timer)
 
     # 4) 摘要
     print("\n===== Summary =====")
@@ -151,7 +178,12 @@ def main():
     print(f"Skipped (question_type not in {ALLOWED_QT}): {skipped_qt}")
     print(f"Skipped (answer not in {ALLOWED_ANS}): {skipped_ans}")
     print(f"Missing/Unreadable images: {missing_img}")
+    if bad_list is not None:
+        print(f"Skipped (in bad list {args.bad_list}): {skipped_bad}")
     print(f"Copy failures: {copy_fail}")
 
+    if args.timing_report:
+        timer.write_report(args.timing_report, extra={"tool": "file_copy", "items": len(output_records)})
+
 if __name__ == "__main__":
     main()
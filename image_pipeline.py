@@ -0,0 +1,127 @@
+# image_pipeline.py
+# 数据集构建的分阶段流水线：
+#   IO 线程池预取原始字节 → 解码/缩放(/编码)线程池（cv2.imdecode + cv2.resize + 可选的 PNG 编码，都会释放 GIL）
+#   → 调用方单线程写出（只追加行，不做 CPU 重活）
+# 在途样本数由 queue_size 限制（背压），结果按输入顺序返回，网络盘读取、CPU 解码、磁盘写入同时进行。
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from pipeline_timing import NULL_TIMER
+
+_DONE = object()
+
+
+def item_image_path(item):
+    return item.get('path') or item.get('image_path') or item.get('file_path')
+
+
+def read_bytes(img_path):
+    """读原始字节；返回 (buf, error, resolve_ns, read_ns)，resolve_ns 为路径检查（stat）耗时。"""
+    t0 = time.perf_counter_ns()
+    if not img_path or not os.path.isfile(img_path):
+        return None, "missing", time.perf_counter_ns() - t0, 0
+    t1 = time.perf_counter_ns()
+    try:
+        buf = np.fromfile(img_path, dtype=np.uint8)
+    except OSError:
+        return None, "unreadable", t1 - t0, time.perf_counter_ns() - t1
+    return buf, None, t1 - t0, time.perf_counter_ns() - t1
+
+
+def decode_resize(buf, resize_hw):
+    """cv2.imdecode + INTER_AREA 缩放；返回 (resized, (h, w), error, decode_ns, resize_ns)。"""
+    t0 = time.perf_counter_ns()
+    image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    t1 = time.perf_counter_ns()
+    if image is None:
+        return None, None, "decode_failed", t1 - t0, 0
+    height, width = image.shape[:2]
+    resized = cv2.resize(image, (resize_hw, resize_hw), interpolation=cv2.INTER_AREA)
+    return resized, (height, width), None, t1 - t0, time.perf_counter_ns() - t1
+
+
+def decode_resize_encode(buf, resize_hw, encode=None):
+    """decode_resize 之后在同一个 worker 里调用 encode(resized)（如编码成 PNG 字节）；多返回一个 encode_ns。"""
+    resized, hw, error, decode_ns, resize_ns = decode_resize(buf, resize_hw)
+    if encode is None or resized is None:
+        return resized, hw, error, decode_ns, resize_ns, 0
+    t0 = time.perf_counter_ns()
+    encoded = encode(resized)
+    return encoded, hw, error, decode_ns, resize_ns, time.perf_counter_ns() - t0
+
+
+class ProcessedImage:
+    __slots__ = ("item", "path", "image", "height", "width", "error", "timings")
+
+    def __init__(self, item, path):
+        self.item = item
+        self.path = path
+        self.image = None
+        self.height = self.width = None
+        self.error = None
+        self.timings = {}
+
+
+def _submit(item, resize_hw, io_pool, decode_pool, encode=None):
+    """提交一条样本：读完字节后在回调里把解码任务提交到解码池，返回最终结果的 Future。"""
+    out = ProcessedImage(item, item_image_path(item))
+    final = Future()
+
+    def on_decoded(fut):
+        try:
+            out.image, hw, out.error, out.timings["decode"], out.timings["resize"], encode_ns = fut.result()
+            if encode is not None:
+                out.timings["encode"] = encode_ns
+            if hw is not None:
+                out.height, out.width = hw
+        except Exception as e:  # 单张图解码异常不应中断整条流水线
+            out.error = f"decode_failed: {e.__class__.__name__}"
+        final.set_result(out)
+
+    def on_read(fut):
+        try:
+            buf, out.error, out.timings["path_resolve"], out.timings["file_read"] = fut.result()
+        except Exception as e:
+            buf, out.error = None, f"unreadable: {e.__class__.__name__}"
+        if buf is None:
+            final.set_result(out)
+            return
+        decode_pool.submit(decode_resize_encode, buf, resize_hw, encode).add_done_callback(on_decoded)
+
+    io_pool.submit(read_bytes, out.path).add_done_callback(on_read)
+    return final
+
+
+def iter_processed_images(items, resize_hw, io_workers=8, decode_workers=None, queue_size=64, timer=NULL_TIMER,
+                          encode=None):
+    """
+    按输入顺序产出 ProcessedImage（error 非空表示该样本失败）。
+    - encode: 可选，在解码线程里把缩放后的数组转换成最终写出的形式（ProcessedImage.image 即其返回值）
+    - io_workers: 读字节线程数（网络盘上可以开大）
+    - decode_workers: 解码/缩放线程数（默认 CPU 核数）
+    - queue_size: 最多同时在途的样本数；调用方（写出端）消费慢时上游自动停顿
+    """
+    decode_workers = decode_workers or os.cpu_count() or 4
+    queue_size = max(queue_size, 1)
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="img-io") as io_pool, \
+            ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="img-decode") as decode_pool:
+        pending = deque()
+        it = iter(items)
+        for item in it:
+            pending.append(_submit(item, resize_hw, io_pool, decode_pool, encode))
+            if len(pending) >= queue_size:
+                break
+        while pending:
+            result = pending.popleft().result()
+            # 各阶段耗时由 worker 测量，在这里（单线程）汇总到 timer
+            for stage, ns in result.timings.items():
+                timer.add(stage, ns)
+            nxt = next(it, _DONE)
+            if nxt is not _DONE:
+                pending.append(_submit(nxt, resize_hw, io_pool, decode_pool, encode))
+            yield result
@@ -0,0 +1,71 @@
+# json_stream.py
+# 不加载整个文件地遍历顶层 JSON 容器（仅用标准库 json.JSONDecoder.raw_decode）：
+# - iter_json_object_items: 顶层 {key: value, ...} → (key, value)
+# - iter_json_array_items:  顶层 [v, v, ...]        → v
+import re
+import json
+
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def _iter_container(path, open_char, close_char, keyed, chunk_size):
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        pos = _WS.match(buf, 0).end()
+        if pos >= len(buf) or buf[pos] != open_char:
+            raise ValueError(f"Top-level JSON {'object' if keyed else 'array'} expected: {path}")
+        pos += 1
+        while True:
+            # 跳过空白和逗号
+            while True:
+                pos = _WS.match(buf, pos).end()
+                if pos < len(buf) and buf[pos] == ",":
+                    pos += 1
+                    continue
+                break
+            if pos >= len(buf):
+                more = f.read(chunk_size)
+                if not more:
+                    raise ValueError(f"Unexpected end of file: {path}")
+                buf, pos = buf[pos:] + more, 0
+                continue
+            if buf[pos] == close_char:
+                return
+            try:
+                end = pos
+                if keyed:
+                    key, end = decoder.raw_decode(buf, end)
+                    end = _WS.match(buf, end).end()
+                    if end >= len(buf):
+                        raise json.JSONDecodeError("need more data", buf, end)
+                    if buf[end] != ":":
+                        raise ValueError(f"Expected ':' after key {key!r} in {path}")
+                    end = _WS.match(buf, end + 1).end()
+                value, end = decoder.raw_decode(buf, end)
+                nxt = _WS.match(buf, end).end()
+                if nxt >= len(buf) or buf[nxt] not in (",", close_char):
+                    # 标量可能被缓冲区截断（"12" | "345"、"123." | "456"、"1e" | "+5"），
+                    # 在缓冲区里看到后面的分隔符才算完整
+                    raise json.JSONDecodeError("need more data", buf, end)
+            except json.JSONDecodeError:
+                # 当前缓冲区里的元素不完整 → 读更多数据后重试
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield (key, value) if keyed else value
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def iter_json_object_items(path, chunk_size=1 << 20):
+    """流式遍历顶层 JSON 对象的 (key, value)。"""
+    return _iter_container(path, "{", "}", True, chunk_size)
+
+
+def iter_json_array_items(path, chunk_size=1 << 20):
+    """流式遍历顶层 JSON 数组的元素。"""
+    return _iter_container(path, "[", "]", False, chunk_size)
@@ -0,0 +1,177 @@
+# label_stats.py
+# QA 文件的标签统计：一次遍历把 (question_type, answer, split) 编码成整数，用 np.bincount 计数；
+# 结果按文件内容哈希缓存，重新打标签后再算也几乎是瞬时的。
+# 还能从计数推出 rl.py / rl_new.py 使用的 aes_weights / ads_weights 反频率权重表。
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from qa_records import FIELD_ALIASES, iter_qa_items
+
+# 与 rl.py 中权重表的键顺序一致
+WEIGHT_LABELS = ["Bad", "Poor", "Fair", "Good", "Excellent"]
+DEFAULT_CACHE_DIR = ".label_stats_cache"
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=8 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _encode(value, vocab, codes):
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(vocab)
+        vocab.append(value)
+    return code
+
+
+def _field(item, name, default):
+    for k in FIELD_ALIASES.get(name, (name,)):
+        if item.get(k) is not None:
+            return item[k]
+    return default
+
+
+def count_labels(path):
+    """
+    统计 QA 文件 → {"counts": [[question_type, answer, split, n], ...], "total": N}
+    没有 split 字段的记录归入 "all"。
+    """
+    vocabs = {"question_type": [], "answer": [], "split": []}
+    lookups = {name: {} for name in vocabs}
+    cols = {name: [] for name in vocabs}
+    for item in iter_qa_items(path):
+        cols["question_type"].append(_encode(_field(item, "question_type", "unknown"), vocabs["question_type"], lookups["question_type"]))
+        cols["answer"].append(_encode(_field(item, "answer", "unknown"), vocabs["answer"], lookups["answer"]))
+        cols["split"].append(_encode(item.get("split", "all"), vocabs["split"], lookups["split"]))
+
+    n_qt, n_ans, n_split = (max(len(vocabs[k]), 1) for k in ("question_type", "answer", "split"))
+    qt = np.asarray(cols["question_type"], dtype=np.int64)
+    ans = np.asarray(cols["answer"], dtype=np.int64)
+    sp = np.asarray(cols["split"], dtype=np.int64)
+    flat = np.bincount((qt * n_ans + ans) * n_split + sp, minlength=n_qt * n_ans * n_split)
+
+    counts = []
+    for key in np.flatnonzero(flat):
+        rest, s = divmod(int(key), n_split)
+        q, a = divmod(rest, n_ans)
+        counts.append([vocabs["question_type"][q], vocabs["answer"][a], vocabs["split"][s], int(flat[key])])
+    return {"counts": counts, "total": int(len(qt))}
+
+
+def load_label_stats(path, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """带缓存的 count_labels：缓存文件名为 QA 文件内容的哈希。"""
+    digest = file_digest(path)
+    cache_path = os.path.join(cache_dir, f"{digest}.json") if cache_dir else None
+    if cache_path and not refresh and os.path.isfile(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") == CACHE_VERSION:
+            return cached
+
+    stats = count_labels(path)
+    stats.update({"version": CACHE_VERSION, "source": os.path.abspath(path), "digest": digest})
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False)
+    return stats
+
+
+def label_counts(stats, question_type, split=None):
+    """{answer: n}，split=None 时合并所有 split。"""
+    out = {}
+    for qt, ans, sp, n in stats["counts"]:
+        if qt == question_type and (split is None or sp == split):
+            out[ans] = out.get(ans, 0) + n
+    return out
+
+
+def inverse_frequency_weights(counts, labels=WEIGHT_LABELS, power=1.0, normalize="sum", cap=None):
+    """
+    反频率权重 w_c ∝ (1 / n_c) ** power：
+    - normalize="sum": 归一化到和为 1（rl.py 的写法）
+    - normalize="max": 最大值为 1（rl_new.py 的写法）
+    - cap: 单类权重最多为次大类的 cap 倍（样本极少的类，如 ads Excellent 只有 11 个；
+           rl.py 的 ads_weights 约等于 cap=18）
+    缺失类别权重为 0。
+    """
+    n = np.array([counts.get(lab, 0) for lab in labels], dtype=np.float64)
+    w = np.zeros_like(n)
+    present = n > 0
+    w[present] = (1.0 / n[present]) ** power
+    if cap is not None and present.any():
+        # 截断到次大类的 cap 倍以内，再统一归一化
+        order = np.sort(w[present])
+        if len(order) > 1:
+            w = np.minimum(w, order[-2] * cap)
+    denom = w.sum() if normalize == "sum" else w.max()
+    if denom > 0:
+        w = w / denom
+    return {lab: round(float(x), 5) for lab, x in zip(labels, w)}
+
+
+def format_weight_tables(stats, split=None, **kwargs):
+    """生成可直接粘贴进 rl.py / rl_new.py 的 aes_weights / ads_weights 代码片段。"""
+    lines = []
+    for qt in ("aes", "ads"):
+        weights = inverse_frequency_weights(label_counts(stats, qt, split), **kwargs)
+        lines.append(f"{qt}_weights = {{")
+        lines.append(",\n".join(f'    "{lab}": {w}' for lab, w in weights.items()))
+        lines.append("}")
+    return "\n".join(lines)
+
+
+def format_summary(stats, split=None):
+    """file_data.txt 风格的统计输出。"""
+    lines = []
+    for qt in ("aes", "ads"):
+        counts = label_counts(stats, qt, split)
+        ordered = dict(sorted(counts.items(), key=lambda kv: -kv[1]))
+        lines.append(f"\n📊 总 {qt.upper()} 评分统计:")
+        lines.append(str(ordered))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized label statistics and class-weight tables for a QA file.")
+    parser.add_argument("--json", required=True, help="QA file (JSON array or JSONL)")
+    parser.add_argument("--split", default=None, help="Only use this split (default: all records)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Cache directory ('' to disable)")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached stats")
+    parser.add_argument("--power", type=float, default=1.0, help="Exponent on inverse frequency")
+    parser.add_argument("--normalize", choices=["sum", "max"], default="sum", help="Weight normalization")
+    parser.add_argument("--cap", type=float, default=None, help="Cap rare-class weight at this multiple of the next largest")
+    parser.add_argument("--out-json", default=None, help="Also write counts + weights as JSON")
+    args = parser.parse_args()
+
+    stats = load_label_stats(args.json, cache_dir=args.cache_dir or None, refresh=args.refresh)
+    print(format_summary(stats, args.split))
+
+    print("\n# ---- class weights ----")
+    kwargs = dict(power=args.power, normalize=args.normalize, cap=args.cap)
+    print(format_weight_tables(stats, args.split, **kwargs))
+
+    if args.out_json:
+        out = {
+            "counts": stats["counts"],
+            "aes_weights": inverse_frequency_weights(label_counts(stats, "aes", args.split), **kwargs),
+            "ads_weights": inverse_frequency_weights(label_counts(stats, "ads", args.split), **kwargs),
+        }
+        with open(args.out_json, "w", encoding="utf-8") as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# lazy_dataset.py
+# 懒加载缩放模式：数据集里只存图片路径、原图 img_height / img_width 和 QA 列，
+# 访问时才解码 + 缩放（与 builder 相同的 cv2.imread + INTER_AREA），带有界的进程内 LRU 缓存。
+# 换分辨率做实验不需要重建数据集，建库只读图片头，几秒完成。
+import os
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from datasets import Features, Value, load_from_disk
+
+LAZY_FEATURES = Features({
+    'id': Value('string'),
+    'problem': Value('string'),
+    'solution': Value('string'),
+    'image_path': Value('string'),
+    'img_height': Value('int64'),
+    'img_width': Value('int64'),
+    'resized_height': Value('int64'),
+    'resized_width': Value('int64')
+})
+
+
+# EXIF Orientation 取这些值时图片要转 90°，cv2.imread 解码时会按它旋转，宽高互换
+EXIF_ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def read_image_size(path):
+    """
+    只读图片头拿 (height, width)，不解码像素；失败返回 None。
+    按 EXIF Orientation 换算成 cv2.imread 解码后的尺寸，与物化模式记录的 img_height / img_width 一致。
+    """
+    from PIL import Image as PILImage
+
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with PILImage.open(path) as im:
+            width, height = im.size
+            if im.getexif().get(EXIF_ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+    except Exception:
+        return None
+    return height, width
+
+
+def read_image_sizes(paths, workers=16):
+    """并行读取图片头（网络盘上主要是 IO 等待），按输入顺序返回。"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_image_size, paths, chunksize=256))
+
+
+class LazyResizeTransform:
+    """
+    datasets 的 set_transform 回调：按 image_path 解码并缩放到 resize_hw，加一列 'image'（PIL.Image）。
+    cache_size 为本进程 LRU 缓存的图片数（每个 DataLoader worker 各自一份）。
+    """
+
+    def __init__(self, resize_hw=None, cache_size=1024, templates=None):
+        self.resize_hw = resize_hw
+        self.cache_size = cache_size
+        # --encode-templates 的数据集：顺带按模板表还原 problem 列
+        self.templates = list(templates) if templates is not None else None
+        self._cache = OrderedDict()
+
+    def _load(self, path, hw):
+        import cv2
+        from PIL import Image as PILImage
+
+        key = (path, hw)
+        image = self._cache.get(key)
+        if image is not None:
+            self._cache.move_to_end(key)
+            return image
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(f"读取失败: {path}")
+        # 与物化模式一致：直接用 cv2 的数组（不做 BGR→RGB），落盘时也是这样编码的
+        image = PILImage.fromarray(cv2.resize(image, (hw, hw), interpolation=cv2.INTER_AREA))
+        if self.cache_size > 0:
+            self._cache[key] = image
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image
+
+    def __call__(self, batch):
+        out = dict(batch)
+        sizes = batch['resized_height']
+        hws = [self.resize_hw or int(h) for h in sizes]
+        out['image'] = [self._load(p, hw) for p, hw in zip(batch['image_path'], hws)]
+        out['resized_height'] = hws
+        out['resized_width'] = hws
+        if self.templates is not None:
+            out['problem'] = [self.templates[i] for i in batch['question_id']]
+        return out
+
+    def __getstate__(self):
+        # 传给 DataLoader worker 时不带缓存
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        return state
+
+
+def load_lazy_dataset(path, resize_hw=None, cache_size=1024):
+    """
+    加载 --output-mode lazy 生成的数据集并挂上 LazyResizeTransform。
+    resize_hw=None 时用建库时记录的 resized_height；给定则按新分辨率缩放（无需重建）。
+    """
+    dataset = load_from_disk(path)
+    splits = dataset.values() if hasattr(dataset, 'values') else [dataset]
+    for ds in splits:
+        templates = ds.features['question_id'].names if 'question_id' in ds.features else None
+        ds.set_transform(LazyResizeTransform(resize_hw=resize_hw, cache_size=cache_size, templates=templates))
+    return dataset
+
+
+def build_lazy_columns(split_items, resize_hw, workers=16):
+    """QA 条目 → create_local_dataset 用的列字典（LAZY_FEATURES）；图片不存在/读不了头的条目打印后跳过。"""
+    from image_pipeline import item_image_path
+
+    paths = [item_image_path(item) for item in split_items]
+    sizes = read_image_sizes(paths, workers=workers)
+    columns = {name: [] for name in LAZY_FEATURES}
+    for item, path, size in zip(split_items, paths, sizes):
+        if size is None:
+            print(f"❌ 图片不存在或读取失败: {path}")
+            continue
+        solution_obj = {
+            "answer": item.get('answer', None),
+            "answer_type": item.get('question_type', None)
+        }
+        columns['id'].append(str(item.get('id', '')))
+        columns['problem'].append(str(item.get('question', '')))
+        columns['solution'].append(json.dumps(solution_obj, ensure_ascii=False))
+        columns['image_path'].append(os.path.abspath(path))
+        columns['img_height'].append(size[0])
+        columns['img_width'].append(size[1])
+        columns['resized_height'].append(resize_hw)
+        columns['resized_width'].append(resize_hw)
+    return columns
@@ -0,0 +1,108 @@
+# merge_shards.py
+# 合并多机分片（--num-shards / --shard-index）的输出：
+# - datasets: 各分片的 {split} DatasetDict → 一个 DatasetDict/split；只拼接 Arrow 表，不重新编码图片，
+#             并重新生成 class_index.npz（prompt_table.json 直接拷贝）；
+#             tensor 模式的分片同时拷贝 .npy、合并 tensor_store.json，并给 tensor_row 加上分片的行偏移
+# - json:     qa_generation / file_copy 的各分片 JSON / JSONL → 一个文件（流式，不整体加载）
+import os
+import json
+import glob
+import shutil
+import argparse
+
+from datasets import DatasetDict, concatenate_datasets, load_from_disk
+
+from balanced_sampler import write_class_index_for_dataset
+from prompts import PROMPT_TABLE_NAME
+from qa_records import iter_qa_items, load_question_templates, write_json_list, write_question_templates
+from tensor_store import STORE_META_NAME, merge_tensor_stores
+
+SPLITS = ["train", "val", "test"]
+
+
+def _expand(patterns):
+    paths = []
+    for p in patterns:
+        matched = sorted(glob.glob(p))
+        paths.extend(matched if matched else [p])
+    return paths
+
+
+def merge_datasets(shard_roots, output_base):
+    """shard_roots: 各分片的 output_base（下面有 train/val/test）。"""
+    for split in SPLITS:
+        split_dirs = [os.path.join(root, split) for root in shard_roots if os.path.isdir(os.path.join(root, split))]
+        if not split_dirs:
+            print(f"⚠️ split={split} 没有分片输出，跳过。")
+            continue
+        parts = [load_from_disk(split_dir)['train'] for split_dir in split_dirs]
+        out_dir = os.path.join(output_base, split)
+        tensor = [os.path.isfile(os.path.join(split_dir, STORE_META_NAME)) for split_dir in split_dirs]
+        if any(tensor):
+            if not all(tensor):
+                raise ValueError(f"split={split}: some shards are tensor stores and some are not; "
+                                 f"rebuild them with the same --output-mode")
+            # 各分片的 tensor_row 都从 0 开始：拷贝 .npy 后按分片的行偏移重新编号
+            offsets = merge_tensor_stores(split_dirs, out_dir)
+            parts = [part.map(lambda batch, offset=offset: {'tensor_row': [r + offset for r in batch['tensor_row']]},
+                              batched=True, keep_in_memory=True)
+                     for part, offset in zip(parts, offsets)]
+        merged = concatenate_datasets(parts)
+        DatasetDict({'train': merged}).save_to_disk(out_dir)
+        write_class_index_for_dataset(load_from_disk(out_dir)['train'], out_dir)
+        # 各分片的 prompt 表相同，拷第一份
+        for root in shard_roots:
+            table = os.path.join(root, split, PROMPT_TABLE_NAME)
+            if os.path.isfile(table):
+                shutil.copyfile(table, os.path.join(out_dir, PROMPT_TABLE_NAME))
+                break
+        print(f"✅ {split}: {len(parts)} 个分片, {merged.num_rows} 行 → {out_dir}")
+
+
+def merge_json(inputs, output):
+    """
+    按输入顺序合并 QA 文件；输出以 .jsonl 结尾则写 JSONL，否则写 JSON 数组（indent=2）。
+    --encode-templates 的分片保持编码，模板表（各分片必须一致）写到输出的 sidecar。
+    """
+    count = [0]
+    templates = [load_question_templates(path) for path in inputs]
+    if any(t != templates[0] for t in templates):
+        raise ValueError("Shards use different question template tables; regenerate them with the same qa_generation.py")
+
+    def iter_all():
+        for path in inputs:
+            for item in iter_qa_items(path, decode=False):
+                count[0] += 1
+                yield item
+
+    with open(output, "w", encoding="utf-8") as f:
+        if output.endswith(".jsonl"):
+            f.writelines(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n" for item in iter_all())
+        else:
+            write_json_list(iter_all(), f, indent=2)
+    if templates and templates[0] is not None:
+        write_question_templates(output, templates[0])
+    print(f"✅ 合并 {len(inputs)} 个文件, {count[0]} 条 → {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge sharded pipeline outputs.")
+    sub = parser.add_subparsers(dest="kind", required=True)
+
+    p_ds = sub.add_parser("datasets", help="Merge dataset_generation shard outputs into one DatasetDict per split")
+    p_ds.add_argument("--inputs", nargs="+", required=True, help="Shard output bases (globs allowed), e.g. data/out/shard-*")
+    p_ds.add_argument("--output-base", required=True, help="Merged output root")
+
+    p_js = sub.add_parser("json", help="Merge qa_generation / file_copy shard JSON or JSONL files")
+    p_js.add_argument("--inputs", nargs="+", required=True, help="Shard JSON/JSONL files (globs allowed)")
+    p_js.add_argument("--output", required=True, help="Merged file (.jsonl → JSONL, otherwise JSON array)")
+
+    args = parser.parse_args()
+    if args.kind == "datasets":
+        merge_datasets(_expand(args.inputs), args.output_base)
+    else:
+        merge_json(_expand(args.inputs), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# near_dup.py
+# 感知哈希近重复检测：同一广告素材的缩放/重导出版本 SHA-256 image_id 不同，
+# 会浪费训练算力，并在 split_by_ratio 切分时泄漏到 val/test。
+# - 并行计算 64 位 DCT pHash（用 cv2.IMREAD_REDUCED_GRAYSCALE_8 直接解码出缩小的灰度图，再缩到 32x32）
+# - 多段索引：64 位拆成 4 段 16 位，汉明距离 ≤ max_distance 的两张图至少有一段相差 ≤ max_distance // 4 位（鸽巢原理）；
+#   每段按段值分桶，枚举 ≤ r 位翻转的邻居段值，查表批量取候选对，NumPy XOR + popcount 向量化算距离。
+#   桶大小约 n / 65536，几十万张图几秒完成；完全相同的哈希先用 np.unique 合并，避免大桶
+# - 并查集把近重复归成组，builder 可以每组只保留一张，或者整组放进同一个 split
+import os
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from qa_records import load_qa_records
+
+DEFAULT_HASH_FILE = "phash.json"
+DEFAULT_MAX_DISTANCE = 6
+
+
+def phash_image(path):
+    """返回 (path, 64 位 pHash 或 None)。"""
+    # 延迟导入，让只读哈希文件的调用方不依赖 cv2
+    import cv2
+    import numpy as np
+
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return path, None
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return path, int(np.packbits(bits).view(">u8")[0])
+
+
+BAND_BITS = 16
+N_BANDS = 64 // BAND_BITS
+MAX_PAIRS_PER_CHUNK = 1 << 22
+
+
+def _popcount64(x):
+    """uint64 数组逐元素 popcount（SWAR）。"""
+    import numpy as np
+
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def _flip_masks(bits, radius):
+    """bits 位内所有权重 ≤ radius 的翻转掩码（含 0）。"""
+    masks = [0]
+    frontier = [0]
+    for _ in range(radius):
+        frontier = sorted({m | (1 << b) for m in frontier for b in range(bits) if not m >> b & 1})
+        masks.extend(frontier)
+    return masks
+
+
+def _candidate_pairs(values, max_distance):
+    """values: 去重后的 uint64 哈希。逐段、逐翻转掩码产出距离 ≤ max_distance 的 (i, j) 对（i < j）。"""
+    import numpy as np
+
+    n = len(values)
+    idx = np.arange(n, dtype=np.int64)
+    masks = _flip_masks(BAND_BITS, max_distance // N_BANDS)
+    for band in range(N_BANDS):
+        keys = ((values >> np.uint64(band * BAND_BITS)) & np.uint64((1 << BAND_BITS) - 1)).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        # 段值只有 16 位：直接用计数表 / 起始下标表查桶，不用 searchsorted
+        bucket_counts = np.bincount(keys, minlength=1 << BAND_BITS)
+        bucket_starts = np.cumsum(bucket_counts) - bucket_counts
+        for mask in masks:
+            probe = keys ^ mask
+            lo = bucket_starts[probe]
+            counts = bucket_counts[probe]
+            cum = np.cumsum(counts)
+            # 按候选对数量分块，单块内存有上界
+            start = 0
+            while start < n:
+                base = cum[start - 1] if start else 0
+                stop = max(start + 1, int(np.searchsorted(cum, base + MAX_PAIRS_PER_CHUNK, side="right")))
+                c = counts[start:stop]
+                total = int(c.sum())
+                if total:
+                    i = np.repeat(idx[start:stop], c)
+                    offsets = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+                    j = order[np.repeat(lo[start:stop], c) + offsets]
+                    keep = i < j
+                    i, j = i[keep], j[keep]
+                    close = _popcount64(values[i] ^ values[j]) <= max_distance
+                    yield i[close], j[close]
+                start = stop
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 保留较小下标为根：分组代表与输入顺序无关（输入按 key 排序）
+            if rb < ra:
+                ra, rb = rb, ra
+            self.parent[rb] = ra
+
+
+def group_near_duplicates(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    hashes: {key: phash}。返回 {key: 组代表 key}，组代表为组内排序最小的 key。
+    """
+    import numpy as np
+
+    keys = sorted(hashes)
+    if not keys:
+        return {}
+    # 完全相同的哈希直接归为一组，索引只处理去重后的哈希
+    uniq, inverse = np.unique(np.array([hashes[k] for k in keys], dtype=np.uint64), return_inverse=True)
+    uf = _UnionFind(len(uniq))
+    for i, j in _candidate_pairs(uniq, max_distance):
+        for a, b in zip(i.tolist(), j.tolist()):
+            uf.union(a, b)
+
+    # 组代表：组内排序最小的 key（keys 已排序，第一次遇到的即最小）
+    rep_of_root = {}
+    out = {}
+    for k, u in zip(keys, inverse.tolist()):
+        root = uf.find(u)
+        out[k] = rep_of_root.setdefault(root, k)
+    return out
+
+
+def load_hashes(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {k: int(v, 16) for k, v in json.load(f).items()}
+
+
+def save_hashes(hashes, path):
+    # 先写临时文件再替换：多机分片共享同一个哈希文件时不会读到写了一半的内容
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({k: f"{v:016x}" for k, v in hashes.items()}, f)
+    os.replace(tmp, path)
+
+
+def compute_hashes(key2path, workers=8, existing=None):
+    """并行计算 pHash；existing 中已有的 key 不重复计算。返回 ({key: phash}, 失败数)。"""
+    hashes = dict(existing or {})
+    todo = {}
+    for key, path in key2path.items():
+        if key not in hashes and path:
+            todo.setdefault(path, []).append(key)
+    failed = 0
+    with Pool(processes=workers) as pool:
+        for path, h in tqdm(pool.imap_unordered(phash_image, list(todo), chunksize=64),
+                            total=len(todo), desc="pHash"):
+            if h is None:
+                failed += 1
+                continue
+            for key in todo[path]:
+                hashes[key] = h
+    return hashes, failed
+
+
+def dedup_groups(items, hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """QA 条目 → {image_id: 组代表 image_id}；没有哈希的图自成一组。"""
+    present = {}
+    for item in items:
+        image_id = item.get('image_id')
+        if image_id in hashes:
+            present[image_id] = hashes[image_id]
+    return group_near_duplicates(present, max_distance)
+
+
+def split_for_group(group_key, ratio=(8, 1, 1), seed=2025):
+    """
+    按组代表的稳定哈希决定 split：同一组（以及同一张图的 aes/ads 两行）总在同一个 split，
+    与处理顺序、分片方式无关。
+    """
+    digest = hashlib.sha1(f"{seed}:{group_key}".encode("utf-8")).digest()
+    u = int.from_bytes(digest[:8], "big") / 2 ** 64 * sum(ratio)
+    if u < ratio[0]:
+        return "train"
+    if u < ratio[0] + ratio[1]:
+        return "val"
+    return "test"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute perceptual hashes and group near-duplicate images.")
+    parser.add_argument("--json", required=True, help="QA file (JSON array or JSONL)")
+    parser.add_argument("--hash-file", default=DEFAULT_HASH_FILE, help="image_id -> pHash cache (reused across runs)")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE, help="Max Hamming distance for near-duplicates")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Worker processes")
+    parser.add_argument("--groups-out", default=None, help="Write {image_id: representative} for multi-member groups")
+    args = parser.parse_args()
+
+    data = load_qa_records(args.json)
+    key2path = {}
+    for item in data:
+        key2path.setdefault(item.get('image_id'), item.get('file_path'))
+    key2path.pop(None, None)
+
+    existing = load_hashes(args.hash_file) if os.path.isfile(args.hash_file) else {}
+    hashes, failed = compute_hashes(key2path, workers=args.workers, existing=existing)
+    save_hashes(hashes, args.hash_file)
+
+    groups = group_near_duplicates({k: hashes[k] for k in key2path if k in hashes}, args.max_distance)
+    sizes = {}
+    for rep in groups.values():
+        sizes[rep] = sizes.get(rep, 0) + 1
+    dup_groups = {rep: n for rep, n in sizes.items() if n > 1}
+
+    print("\n===== Summary =====")
+    print(f"Images: {len(key2path)}  hashed: {len(hashes)}  failed: {failed}")
+    print(f"Near-duplicate groups: {len(dup_groups)}  images in them: {sum(dup_groups.values())}"
+          f"  removable: {sum(dup_groups.values()) - len(dup_groups)}")
+    if args.groups_out:
+        with open(args.groups_out, "w", encoding="utf-8") as f:
+            json.dump({k: rep for k, rep in groups.items() if rep in dup_groups}, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# pipeline_timing.py
+# 数据流水线的分阶段计时：每个阶段（JSON 解析、路径解析、读文件、解码、缩放、编码、Arrow 写入、复制…）
+# 每条样本记一次耗时，累加到半倍频（√2）对数直方图里，开销只有一次 perf_counter_ns + 几次整数运算。
+# 结束时写 JSON 报告，按 IO / CPU 阶段汇总，判断一次运行是 IO 受限还是 CPU 受限。
+import os
+import json
+import time
+
+# 阶段分类：用于 IO / CPU 占比
+# 除 columnar_write（qa_generation 每个工作单元一次）外，每个阶段都是每条样本记一次
+IO_STAGES = {"path_resolve", "file_read", "arrow_write", "tensor_write", "copy", "write", "columnar_write"}
+CPU_STAGES = {"json_parse", "decode", "resize", "encode", "build"}
+
+_NUM_BUCKETS = 130  # 2 * 64 位 + 余量
+
+
+def _bucket(ns):
+    b = ns.bit_length()
+    if b < 2:
+        return b * 2
+    return b * 2 + ((ns >> (b - 2)) & 1)
+
+
+def _bucket_floor(idx):
+    """直方图下标 → 该桶的下界（ns）。"""
+    b, sub = divmod(idx, 2)
+    if b < 2:
+        return b
+    return (1 << (b - 1)) | (sub << (b - 2))
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "t0")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter_ns() - self.t0)
+        return False
+
+
+class StageTimer:
+    """
+    用法：
+        timer = StageTimer()
+        with timer.stage("decode"):
+            ...
+        # 或者热循环里手动：t0 = time.perf_counter_ns(); ...; timer.add("decode", time.perf_counter_ns() - t0)
+        timer.write_report("timing.json")
+    多进程时 worker 返回 snapshot()，主进程 merge()。
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stats = {}  # name -> [count, total_ns, min_ns, max_ns, buckets]
+        self.t_start = time.perf_counter()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, ns):
+        st = self.stats.get(name)
+        if st is None:
+            st = self.stats[name] = [0, 0, ns, ns, [0] * _NUM_BUCKETS]
+        st[0] += 1
+        st[1] += ns
+        if ns < st[2]:
+            st[2] = ns
+        if ns > st[3]:
+            st[3] = ns
+        st[4][_bucket(ns)] += 1
+
+    def snapshot(self):
+        return {name: [c, t, lo, hi, list(b)] for name, (c, t, lo, hi, b) in self.stats.items()}
+
+    def merge(self, snapshot):
+        for name, (c, t, lo, hi, buckets) in snapshot.items():
+            st = self.stats.get(name)
+            if st is None:
+                self.stats[name] = [c, t, lo, hi, list(buckets)]
+                continue
+            st[0] += c
+            st[1] += t
+            st[2] = min(st[2], lo)
+            st[3] = max(st[3], hi)
+            st[4] = [x + y for x, y in zip(st[4], buckets)]
+
+    @staticmethod
+    def _percentile(buckets, count, q):
+        target = q * count
+        seen = 0
+        for idx, n in enumerate(buckets):
+            seen += n
+            if n and seen >= target:
+                return _bucket_floor(idx)
+        return 0
+
+    def report(self, extra=None):
+        wall = time.perf_counter() - self.t_start
+        stages = {}
+        io_ns = cpu_ns = other_ns = 0
+        total_ns = sum(st[1] for st in self.stats.values()) or 1
+        for name, (c, t, lo, hi, buckets) in sorted(self.stats.items(), key=lambda kv: -kv[1][1]):
+            stages[name] = {
+                "count": c,
+                "total_s": round(t / 1e9, 4),
+                "share": round(t / total_ns, 4),
+                "mean_us": round(t / max(c, 1) / 1e3, 2),
+                "min_us": round(lo / 1e3, 2),
+                "p50_us": round(self._percentile(buckets, c, 0.50) / 1e3, 2),
+                "p90_us": round(self._percentile(buckets, c, 0.90) / 1e3, 2),
+                "p99_us": round(self._percentile(buckets, c, 0.99) / 1e3, 2),
+                "max_us": round(hi / 1e3, 2),
+                "histogram": {str(_bucket_floor(i)): n for i, n in enumerate(buckets) if n},
+            }
+            if name in IO_STAGES:
+                io_ns += t
+            elif name in CPU_STAGES:
+                cpu_ns += t
+            else:
+                other_ns += t
+        summary = {
+            "wall_s": round(wall, 3),
+            "measured_s": round(total_ns / 1e9, 3),
+            "io_share": round(io_ns / total_ns, 4),
+            "cpu_share": round(cpu_ns / total_ns, 4),
+            "other_share": round(other_ns / total_ns, 4),
+            "bound": "io" if io_ns > cpu_ns else "cpu",
+            "pid": os.getpid(),
+        }
+        if extra:
+            summary.update(extra)
+        return {"summary": summary, "stages": stages}
+
+    def write_report(self, path, extra=None):
+        rep = self.report(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+        s = rep["summary"]
+        print(f"⏱️ 计时报告已保存到: {path}  (IO {s['io_share']:.0%} / CPU {s['cpu_share']:.0%} → {s['bound']}-bound)")
+        return rep
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTimer:
+    """关闭计时时使用：所有方法都是空操作。"""
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, ns):
+        pass
+
+    def snapshot(self):
+        return {}
+
+    def merge(self, snapshot):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def make_timer(report_path):
+    """--timing-report 为空时返回空计时器。"""
+    return StageTimer() if report_path else NULL_TIMER
@@ -0,0 +1,102 @@
+# prompts.py
+# rl_new.py 里的 user_prompt（指令、规则、示例约 1.5 KB）原样搬到这里，按 {Question} 切成共享的前缀 / 后缀：
+# - PromptTable 只存一份前缀 / 后缀，外加按模板预渲染好的完整 prompt（16 个模板 → 16 条）
+# - 数据集每行只存问题本身（problem 列，或 --encode-templates 的 question_id），数据集大小与 prompt 长度无关
+# - 训练时 render / render_batch 是一次查表（模板问题）或一次拼接（其他问题），不再在 dataloader 里 format
+import os
+import json
+
+# 与 rl_new.py 中 self.user_prompt 逐字节一致（str.format 模板，{{ }} 为转义的花括号）
+USER_PROMPT = """<image>\n
+        {Question}
+        Follow the OUTPUT rules.
+        You are VisionReasoner for evaluating the visual and communicative quality of advertisement-style images.
+
+        INPUT: one image and one natural-language question.
+
+        OUTPUT (STRICT): return EXACTLY two blocks:
+        <think>1–3 short sentences of reasoning.</think><answer>[{{"answer": ..., "confidence": p, "answer_type": "ads"|"aes"}}]</answer>
+
+        RULES:
+        - DO NOT add any text before <think> or after </answer>.
+        - "confidence" ∈ [0,1]. REQUIRED.
+        - "answer" depends on question type; "answer_type" MUST be one of:
+            - "aes" → for aesthetic quality (visual appeal, artistry, clarity, composition…)
+            - "ads" → for advertising quality (clarity of message, persuasive power, brand emphasis…)
+
+        TASK TYPES:
+        - If the question asks for a rating in "(Bad, Poor, Fair, Good, Excellent)" → it's classification; return one of those 5 labels.
+        - Identify whether the question refers to aesthetic quality vs advertising quality clarity to decide answer_type.
+
+        EXAMPLES:
+        <think>The image is blurry with poor lighting and no focal emphasis.</think><answer>[{{"answer":"Poor", "confidence":0.81, "answer_type":"aes"}}]</answer>
+
+        <think>The ad communicates its purpose clearly with a strong slogan and clean layout.</think><answer>[{{"answer":"Good", "confidence":0.92, "answer_type":"ads"}}]</answer>
+
+        DISCIPLINE:
+        - Do NOT guess. Only use what is clearly seen in the image.
+        - Be concise but informative in <think>.
+        - Use only canonical labels for "answer" and exact "answer_type".
+"""
+
+PROMPT_TABLE_NAME = "prompt_table.json"
+
+
+def split_prompt(template=USER_PROMPT):
+    """template.format(Question=q) == prefix + q + suffix。"""
+    sentinel = "\x00"
+    prefix, found, suffix = template.format(Question=sentinel).partition(sentinel)
+    if not found:
+        raise ValueError("Prompt template has no {Question} placeholder.")
+    return prefix, suffix
+
+
+class PromptTable:
+    """
+    共享前缀 / 后缀 + 预渲染的模板 prompt。
+    templates 的下标与数据集 question_id（ClassLabel）一致时，render_id 直接按 id 取。
+    """
+
+    def __init__(self, prefix, suffix, templates=()):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.templates = list(templates)
+        self.rendered = [prefix + q + suffix for q in self.templates]
+        self._by_question = dict(zip(self.templates, self.rendered))
+
+    @classmethod
+    def from_template(cls, template=USER_PROMPT, templates=()):
+        prefix, suffix = split_prompt(template)
+        return cls(prefix, suffix, templates)
+
+    def render(self, question):
+        rendered = self._by_question.get(question)
+        return rendered if rendered is not None else self.prefix + question + self.suffix
+
+    def render_id(self, question_id):
+        return self.rendered[question_id]
+
+    def render_batch(self, batch):
+        """datasets 的 batch（dict of lists）→ prompt 列表；有 question_id 列时按 id 查表。"""
+        if "question_id" in batch:
+            return [self.rendered[i] for i in batch["question_id"]]
+        return [self.render(q) for q in batch["problem"]]
+
+    def transform(self, batch):
+        """可直接用于 dataset.set_transform / with_transform：在原列之外加一列 'prompt'。"""
+        out = dict(batch)
+        out["prompt"] = self.render_batch(batch)
+        return out
+
+    def save(self, split_dir):
+        path = os.path.join(split_dir, PROMPT_TABLE_NAME)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"prefix": self.prefix, "suffix": self.suffix, "templates": self.templates},
+                      f, ensure_ascii=False, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, split_dir):
+        with open(os.path.join(split_dir, PROMPT_TABLE_NAME), "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        return cls(obj["prefix"], obj["suffix"], obj.get("templates", ()))
@@ -1,6 +1,13 @@
 import os
 import json
 import random
+import argparse
+from multiprocessing import Pool
+
+from pipeline_timing import NULL_TIMER, StageTimer, make_timer
+from qa_records import QATable, write_json_list, write_question_templates
+from sharding import add_shard_args, check_shard_args, in_shard, shard_output_path
+from step1_store import is_packed_store, iter_packed_records, iter_shard_records, iter_shard_spans, load_index, select_spans
 
 # 定义问题模板
 aes_questions = [
@@ -25,39 +32,236 @@ ads_questions = [
     "How would you rate the overall persuasiveness of this advertisement?"
 ]
 
-def build_qa_from_json(input_dir, output_file):
-    all_qas = []
-    
+# 模板表：question_id 即下标（只能在末尾追加，否则已编码的文件会解错）
+QUESTION_TEMPLATES = aes_questions + ads_questions
+TEMPLATE2ID = {q: i for i, q in enumerate(QUESTION_TEMPLATES)}
+
+def _read_json_file(path, timer=NULL_TIMER):
+    with timer.stage("file_read"):
+        with open(path, "rb") as f:
+            raw = f.read()
+    with timer.stage("json_parse"):
+        return json.loads(raw)
+
+def shard_selector(num_shards, shard_index):
+    """多机分片时返回 select(image_id)，否则 None。"""
+    if num_shards <= 1:
+        return None
+    return lambda image_id: in_shard(image_id, num_shards, shard_index)
+
+def _image_id_of(filename):
+    # step1 文件名即 {image_id}.json（convert_raw_annotations.py 的命名），不用打开文件就能判断分片
+    return os.path.basename(filename)[:-len(".json")]
+
+def _read_sharded_json_file(path, timer=NULL_TIMER):
+    """
+    分片模式下读取按文件名选中的 step1 文件，并确认文件名就是记录里的 image_id：
+    file_copy / dataset_generation 按 item['image_id'] 分片，名字不一致时同一张图会落到不同分片。
+    """
+    data = _read_json_file(path, timer)
+    if data["image_id"] != _image_id_of(path):
+        raise ValueError(f"{path}: image_id {data['image_id']!r} does not match the file name; sharding needs "
+                         f"<image_id>.json files (or pack the directory with step1_store.py, which indexes by image_id)")
+    return data
+
+def iter_step1_records(input_dir, timer=NULL_TIMER, select=None):
+    """
+    读取 step1 记录：
+    - input_dir 是 step1_store 打包目录（含 index.json）→ 顺序读 JSONL 分片
+    - 否则按原方式逐个读取目录下的 *.json
+    select(image_id) 非空时先按文件名 / 索引筛选，不属于本分片的记录不打开、不解析。
+    """
+    if is_packed_store(input_dir):
+        yield from iter_packed_records(input_dir, timer, select=select)
+        return
     for filename in os.listdir(input_dir):
-        if filename.endswith(".json"):
-            with open(os.path.join(input_dir, filename), "r", encoding="utf-8") as f:
-                data = json.load(f)
-                
-                # 生成美学问题
-                aes_question = random.choice(aes_questions)
-                all_qas.append({
-                    "id": data["id"],
-                    "image_id": data["image_id"],
-                    "file_path": data["file_path"],
-                    "question": aes_question,
-                    "answer": data["aes_score"],
-                    "question_type": "aes"
-                })
-                
-                # 生成广告属性问题
-                ads_question = random.choice(ads_questions)
-                all_qas.append({
-                    "id": data["id"],
-                    "image_id": data["image_id"],
-                    "file_path": data["file_path"],
-                    "question": ads_question,
-                    "answer": data["ads_score"],
-                    "question_type": "ads"
-                })
+        if not filename.endswith(".json"):
+            continue
+        if select is None:
+            yield _read_json_file(os.path.join(input_dir, filename), timer)
+        elif select(_image_id_of(filename)):
+            yield _read_sharded_json_file(os.path.join(input_dir, filename), timer)
+
+def make_qa_pair(data, rng=random):
+    """一条 step1 记录 → [aes 问题, ads 问题]；rng 决定模板选择。"""
+    # 生成美学问题
+    aes_question = rng.choice(aes_questions)
+    # 生成广告属性问题
+    ads_question = rng.choice(ads_questions)
+    return [
+        {
+            "id": data["id"],
+            "image_id": data["image_id"],
+            "file_path": data["file_path"],
+            "question": aes_question,
+            "answer": data["aes_score"],
+            "question_type": "aes"
+        },
+        {
+            "id": data["id"],
+            "image_id": data["image_id"],
+            "file_path": data["file_path"],
+            "question": ads_question,
+            "answer": data["ads_score"],
+            "question_type": "ads"
+        },
+    ]
+
+def encode_template(qa):
+    """question 字符串 → question_id（字段位置不变）；模板表另存一份在 sidecar / Parquet 元数据里。"""
+    return {("question_id" if k == "question" else k): (TEMPLATE2ID[v] if k == "question" else v)
+            for k, v in qa.items()}
+
+def build_qa_from_json(input_dir, output_file, timer=NULL_TIMER, num_shards=1, shard_index=0,
+                       encode_templates=False):
+    # 按列存储，避免 50 万个 dict 常驻内存
+    all_qas = QATable()
+    
+    # 多机分片：只读取 image_id 哈希落在本分片的记录
+    for data in iter_step1_records(input_dir, timer, select=shard_selector(num_shards, shard_index)):
+        with timer.stage("build"):
+            all_qas.extend(make_qa_pair(data))
     
-    # 保存最终结果
+    # 保存最终结果（格式与 json.dump(indent=2) 相同）；每条 QA 记一次 write
     with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_qas, f, ensure_ascii=False, indent=2)
+        items = all_qas.to_dicts()
+        write_json_list(map(encode_template, items) if encode_templates else items, f, indent=2, timer=timer)
+    if encode_templates:
+        write_question_templates(output_file, QUESTION_TEMPLATES)
+    return all_qas
+
+# ---------------- 并行流式模式 ----------------
+
+def list_work_units(input_dir, chunk_size, select=None):
+    """
+    切分工作单元（顺序固定，保证同一 seed 下结果可复现）：
+    - 打包存储：每个 JSONL 分片一个单元
+    - 普通目录：排序后的文件名每 chunk_size 个一个单元
+    select(image_id) 非空时单元划分不变，但每个单元只保留本分片的记录：
+    打包存储按索引给出 (offset, length)，目录按文件名筛选（读取时再核对文件名与 image_id 一致）。
+    """
+    if is_packed_store(input_dir):
+        index = load_index(input_dir)
+        paths = [os.path.join(input_dir, name) for name in index["shards"]]
+        if select is None:
+            return [("shard", path) for path in paths]
+        return [("spans", (path, spans)) for path, spans in zip(paths, select_spans(index, select))]
+    filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".json"))
+    return [("files" if select is None else "sharded_files",
+             [os.path.join(input_dir, f) for f in filenames[i:i + chunk_size]
+              if select is None or select(_image_id_of(f))])
+            for i in range(0, len(filenames), chunk_size)]
+
+def _iter_unit_records(unit, timer=NULL_TIMER):
+    kind, payload = unit
+    if kind == "shard":
+        yield from iter_shard_records(payload, timer)
+    elif kind == "spans":
+        yield from iter_shard_spans(*payload, timer=timer)
+    elif kind == "sharded_files":
+        for path in payload:
+            yield _read_sharded_json_file(path, timer)
+    else:
+        for path in payload:
+            yield _read_json_file(path, timer)
+
+def record_rng(seed, image_id):
+    """每条记录独立的 RNG，只由 (seed, image_id) 决定：与进程数、单元划分、分片数都无关，分片合并后与单机一致。"""
+    return random.Random(f"{seed}:{image_id}")
+
+def _build_unit(task):
+    unit, seed, timed, encode_templates = task
+    timer = StageTimer() if timed else NULL_TIMER
+    qas = []
+    for data in _iter_unit_records(unit, timer):
+        with timer.stage("build"):
+            pair = make_qa_pair(data, record_rng(seed, data["image_id"]))
+            qas.extend(map(encode_template, pair) if encode_templates else pair)
+    return qas, timer.snapshot()
+
+def _columnar_writer(path, encode_templates=False):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("image_id", pa.string()),
+        ("file_path", pa.string()),
+        ("question_id", pa.int16()) if encode_templates else ("question", pa.string()),
+        ("answer", pa.string()),
+        ("question_type", pa.string()),
+    ])
+    if encode_templates:
+        # 模板表放在 schema 元数据里，整个文件只存一份
+        schema = schema.with_metadata({"question_templates": json.dumps(QUESTION_TEMPLATES, ensure_ascii=False)})
+    return pa, pq.ParquetWriter(path, schema, compression="zstd", use_dictionary=True)
+
+def build_qa_streaming(input_dir, output_file, workers=4, seed=42, chunk_size=2000, columnar_file=None,
+                       timer=NULL_TIMER, num_shards=1, shard_index=0, encode_templates=False):
+    """
+    多进程生成 QA，结果按单元顺序逐行写 JSONL（内存只保留在途单元）。
+    columnar_file 非空时同时写一份 Parquet（字典编码 + zstd）。
+    encode_templates: 只写 question_id，模板表写到 {output_file}.meta.json / Parquet schema 元数据。
+    timer 开启时 worker 各自计时，主进程合并；write 每条 QA 记一次，
+    columnar_write 是整个单元一次 write_table（每单元一条，不是每条 QA）。
+    返回写出的 QA 条数。
+    """
+    # 多机分片：在切分单元时就按文件名 / 索引筛掉其他分片的记录，worker 只打开本分片的数据
+    units = list_work_units(input_dir, chunk_size, select=shard_selector(num_shards, shard_index))
+    tasks = [(unit, seed, timer.enabled, encode_templates) for unit in units]
+
+    pa = pq_writer = None
+    if columnar_file:
+        pa, pq_writer = _columnar_writer(columnar_file, encode_templates)
+
+    n = 0
+    with open(output_file, "w", encoding="utf-8") as out, Pool(processes=workers) as pool:
+        for qas, snapshot in pool.imap(_build_unit, tasks):
+            timer.merge(snapshot)
+            for qa in qas:
+                with timer.stage("write"):
+                    out.write(json.dumps(qa, ensure_ascii=False, separators=(",", ":")) + "\n")
+            if pq_writer is not None and qas:
+                with timer.stage("columnar_write"):
+                    pq_writer.write_table(pa.Table.from_pylist(qas, schema=pq_writer.schema))
+            n += len(qas)
+
+    if pq_writer is not None:
+        pq_writer.close()
+    if encode_templates:
+        write_question_templates(output_file, QUESTION_TEMPLATES)
+    return n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build aes/ads QA pairs from step1 records.")
+    parser.add_argument("--input", default="step1", help="step1 directory, or a packed store built by step1_store.py")
+    parser.add_argument("--output", default="qa_dataset.json",
+                        help="Output QA file (JSON list, or JSONL with --jsonl); with --num-shards > 1 the shard suffix is "
+                             "inserted before the extension")
+    parser.add_argument("--jsonl", action="store_true", help="Parallel streaming mode: write one compact JSON object per line")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes for --jsonl mode")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the per-record template RNG, keyed by image_id (--jsonl mode)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="step1 files per work unit for unpacked input (--jsonl mode)")
+    parser.add_argument("--columnar", default=None, help="Also write a Parquet copy to this path (--jsonl mode, needs pyarrow)")
+    parser.add_argument("--encode-templates", action="store_true",
+                        help="Store question_id instead of the question text; templates go to <output>.meta.json")
+    parser.add_argument("--timing-report", default=None, help="Write per-stage timing report (JSON) to this path")
+    add_shard_args(parser)
+    args = parser.parse_args()
+    check_shard_args(args)
 
-# 使用示例
-build_qa_from_json("step1", "qa_dataset.json")
+    timer = make_timer(args.timing_report)
+    # 多机分片：每个分片写自己的文件（共享文件系统上不互相覆盖），之后用 merge_shards.py json 合并
+    output = shard_output_path(args.output, args.num_shards, args.shard_index)
+    columnar = shard_output_path(args.columnar, args.num_shards, args.shard_index) if args.columnar else None
+    if args.jsonl:
+        n = build_qa_streaming(args.input, output, workers=args.workers, seed=args.seed,
+                               chunk_size=args.chunk_size, columnar_file=columnar, timer=timer,
+                               num_shards=args.num_shards, shard_index=args.shard_index,
+                               encode_templates=args.encode_templates)
+        print(f"[OK] 写出 {n} 条 QA → {output}")
+    else:
+        n = len(build_qa_from_json(args.input, output, timer=timer,
+                                   num_shards=args.num_shards, shard_index=args.shard_index,
+                                   encode_templates=args.encode_templates))
+    if args.timing_report:
+        timer.write_report(args.timing_report, extra={"tool": "qa_generation", "items": n})
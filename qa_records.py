@@ -0,0 +1,298 @@
+# qa_records.py
+# qa_generation / file_copy / dataset_generation 共用的紧凑 QA 记录表。
+# 50 万行的 QA 文件如果每行一个 dict，重复字符串（64 位 image_id、长绝对路径、16 个问题模板、
+# 5 个标签、2 种类型）占掉绝大部分内存。这里按列存储：
+# - id:                 array('q')（遇到非整数 id 时退化为 list）
+# - image_id / 文件名:   sys.intern，同一张图的 aes/ads 两行共享同一个字符串
+# - file_path:          目录字典编码 + 文件名
+# - question / answer / question_type: 字典编码（array('H') codes + vocab；取值超过 65535 种时自动换成 array('I')）
+# 带 --encode-templates 写出的 QA 文件只存 question_id（模板表下标），模板表存一份在
+# {path}.meta.json 里；iter_qa_items 读取时自动还原 question。
+import os
+import sys
+import json
+from array import array
+
+from json_stream import iter_json_array_items
+from pipeline_timing import NULL_TIMER
+
+# 字段别名（历史文件里有 quetion / quetion_type 拼写，以及 path / image_path）
+FIELD_ALIASES = {
+    "question": ("question", "quetion"),
+    "question_type": ("question_type", "quetion_type"),
+    "file_path": ("file_path", "path", "image_path"),
+}
+ALIAS2FIELD = {alias: field for field, aliases in FIELD_ALIASES.items() for alias in aliases}
+FIELDS = ("id", "image_id", "file_path", "question", "answer", "question_type")
+DICT_FIELDS = ("question", "answer", "question_type")
+META_SUFFIX = ".meta.json"
+
+_MISSING = object()
+
+
+def _first(d, keys):
+    for k in keys:
+        if k in d:
+            return d[k]
+    return None
+
+
+class _Dictionary:
+    """字符串 ↔ 小整数编码。None 固定编码为 0。"""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class QARecord:
+    """
+    QATable 中一行的只读视图，兼容现有代码对 dict 的用法：
+    item.get(k, default) / item[k] / k in item / to_dict()。
+    """
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def get(self, key, default=None):
+        value = self._table.value(self._row, ALIAS2FIELD.get(key, key), _MISSING)
+        return default if value is _MISSING or value is None else value
+
+    def __getitem__(self, key):
+        value = self._table.value(self._row, ALIAS2FIELD.get(key, key), _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return ALIAS2FIELD.get(key, key) in FIELDS
+
+    @property
+    def row(self):
+        return self._row
+
+    def to_dict(self):
+        return self._table.row_dict(self._row)
+
+    def __repr__(self):
+        return f"QARecord({self.to_dict()!r})"
+
+
+class QATable:
+    """按列存储的 QA 记录表。只保留 FIELDS 中的字段，其他字段丢弃。"""
+
+    def __init__(self):
+        self.ids = array("q")
+        self._ids_is_list = False
+        self.image_ids = []
+        self.dir_codes = array("I")
+        self.file_names = []
+        self.dirs = _Dictionary()
+        self.dicts = {name: _Dictionary() for name in DICT_FIELDS}
+        self.codes = {name: array("H") for name in DICT_FIELDS}
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return QARecord(self, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield QARecord(self, row)
+
+    # ---------- 写入 ----------
+
+    def _append_id(self, value):
+        if not self._ids_is_list:
+            if isinstance(value, int) and not isinstance(value, bool):
+                self.ids.append(value)
+                return
+            # 出现字符串 / None 等 id 时退化为普通 list
+            self.ids = list(self.ids)
+            self._ids_is_list = True
+        self.ids.append(value)
+
+    def append(self, item):
+        """追加一条 dict 形式的 QA 记录（自动处理字段别名）。"""
+        self._append_id(item.get("id"))
+        image_id = item.get("image_id")
+        self.image_ids.append(sys.intern(image_id) if isinstance(image_id, str) else image_id)
+
+        fp = _first(item, FIELD_ALIASES["file_path"])
+        if fp is None:
+            self.dir_codes.append(0)
+            self.file_names.append(None)
+        else:
+            head, tail = os.path.split(str(fp))
+            self.dir_codes.append(self.dirs.encode(head))
+            self.file_names.append(sys.intern(tail))
+
+        for name in DICT_FIELDS:
+            value = _first(item, FIELD_ALIASES.get(name, (name,)))
+            code = self.dicts[name].encode(value)
+            codes = self.codes[name]
+            if code > 0xFFFF and codes.typecode == "H":
+                # 自由文本问题等高基数列：扩宽编码
+                codes = self.codes[name] = array("I", codes)
+            codes.append(code)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+        return self
+
+    # ---------- 读取 ----------
+
+    def value(self, row, field, default=None):
+        if field in self.codes:
+            return self.dicts[field].values[self.codes[field][row]]
+        if field == "id":
+            return self.ids[row]
+        if field == "image_id":
+            return self.image_ids[row]
+        if field == "file_path":
+            name = self.file_names[row]
+            if name is None:
+                return None
+            head = self.dirs.values[self.dir_codes[row]]
+            return os.path.join(head, name) if head else name
+        return default
+
+    def row_dict(self, row):
+        return {field: self.value(row, field) for field in FIELDS}
+
+    def to_dicts(self):
+        for row in range(len(self)):
+            yield self.row_dict(row)
+
+    def column(self, field):
+        return [self.value(row, field) for row in range(len(self))]
+
+    def vocab(self, field):
+        """字典编码列的取值表（下标即 code，0 为 None）。"""
+        return self.dicts[field].values
+
+    def group_rows(self, *fields):
+        """按若干字典编码列分组 → {(v1, v2, ...): [row, ...]}，只用整数 code 比较。"""
+        groups = {}
+        cols = [self.codes[f] for f in fields]
+        for row in range(len(self)):
+            groups.setdefault(tuple(c[row] for c in cols), []).append(row)
+        return {tuple(self.dicts[f].values[c] for f, c in zip(fields, key)): rows
+                for key, rows in groups.items()}
+
+
+def meta_path(path):
+    return str(path) + META_SUFFIX
+
+
+def write_question_templates(path, templates):
+    """把模板表写到 QA 文件旁的 {path}.meta.json（每个文件只存一份）。"""
+    with open(meta_path(path), "w", encoding="utf-8") as f:
+        json.dump({"question_templates": list(templates)}, f, ensure_ascii=False, indent=2)
+
+
+def load_question_templates(path):
+    """读取 {path}.meta.json 中的模板表；没有 sidecar（未编码的文件）返回 None。"""
+    mp = meta_path(path)
+    if not os.path.isfile(mp):
+        return None
+    with open(mp, "r", encoding="utf-8") as f:
+        return json.load(f).get("question_templates")
+
+
+def _iter_raw_items(path):
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1024).lstrip()
+    if head.startswith("["):
+        yield from iter_json_array_items(path)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_qa_items(path, decode=True):
+    """
+    逐条读取 QA 文件：JSON 数组（json.dump 输出）或 JSONL（qa_generation --jsonl 输出）。
+    decode=True 时按 sidecar 模板表把 question_id 还原成 question（question_id 保留）。
+    """
+    templates = load_question_templates(path) if decode else None
+    if templates is None:
+        yield from _iter_raw_items(path)
+        return
+    for item in _iter_raw_items(path):
+        if "question_id" in item and "question" not in item:
+            item["question"] = templates[item["question_id"]]
+        yield item
+
+
+def load_qa_records(path):
+    """流式加载 QA 文件到 QATable，不会先构造整份 dict 列表。"""
+    return QATable().extend(iter_qa_items(path))
+
+
+def decode_question_ids(dataset):
+    """
+    dataset_generation --encode-templates 生成的数据集：按 question_id 列 ClassLabel 的模板表还原问题文本。
+    按模板筛选不需要还原，直接比较整数：np.asarray(dataset["question_id"]) == k。
+    """
+    names = dataset.features["question_id"].names
+    return [names[i] for i in dataset["question_id"]]
+
+
+class ProblemDecoder:
+    """set_transform / with_transform 回调：按模板表把 question_id 还原成 problem 列，其他列原样返回。"""
+
+    def __init__(self, templates):
+        self.templates = list(templates)
+
+    def __call__(self, batch):
+        out = dict(batch)
+        out["problem"] = [self.templates[i] for i in batch["question_id"]]
+        return out
+
+
+def with_problem_column(dataset):
+    """
+    读取 --encode-templates 数据集（Dataset 或 DatasetDict）的入口：访问时按行还原 problem，
+    与未编码的数据集用法一致（row["problem"]）。set_transform 不随 save_to_disk 保存，加载后需调用一次。
+    """
+    if hasattr(dataset, "features"):
+        if "question_id" not in dataset.features:
+            return dataset
+        return dataset.with_transform(ProblemDecoder(dataset.features["question_id"].names))
+    return type(dataset)({split: with_problem_column(ds) for split, ds in dataset.items()})
+
+
+def write_json_list(items, f, indent=2, timer=NULL_TIMER):
+    """
+    逐条写出 JSON 数组，格式与 json.dump(list, indent=indent) 一致，但无需先构造整个列表。
+    timer: 每条记录的序列化 + 写入记一次 "write"。
+    """
+    pad = " " * indent
+    first = True
+    for item in items:
+        with timer.stage("write"):
+            body = json.dumps(item, ensure_ascii=False, indent=indent)
+            f.write(("[\n" if first else ",\n") + pad + body.replace("\n", "\n" + pad))
+        first = False
+    f.write("[]" if first else "\n]")
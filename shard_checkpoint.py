@@ -0,0 +1,176 @@
+# shard_checkpoint.py
+# 可断点续跑的 split 构建：每个 split 按 shard_size 条切成若干分片，每个分片直接写成一个 Arrow 文件
+# {output_dir}/_shards/shard-XXXXX.arrow 并记一笔进度日志 {output_dir}/_progress.json。
+# 崩溃 / OOM 后用 --resume 重新运行：校验已完成的分片（文件存在、行数与日志一致、输入指纹一致），
+# 保留连续有效的前缀，从第一个未完成的分片继续；全部完成后把分片文件原样改名成 DatasetDict 的数据文件，
+# 只补写元数据（与 save_to_disk 的目录结构相同），图片字节只写一次。
+import os
+import json
+import shutil
+import hashlib
+
+from datasets import Dataset, concatenate_datasets, config, load_from_disk
+from datasets.utils.py_utils import asdict
+
+JOURNAL_NAME = "_progress.json"
+SHARDS_DIR = "_shards"
+
+
+def items_fingerprint(items, *extra):
+    """输入条目（按顺序）+ 构建参数的指纹；任何一项变化都会让旧分片失效。"""
+    h = hashlib.sha1(json.dumps(extra, ensure_ascii=False, default=str).encode("utf-8"))
+    for item in items:
+        h.update("\x1f".join(str(item.get(k, "")) for k in ("id", "image_id", "question", "answer",
+                                                             "question_type", "file_path")).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def shard_file_name(k):
+    return f"shard-{k:05d}.arrow"
+
+
+def publish_arrow_files(arrow_paths, output_dir, split="train"):
+    """
+    把写好的 Arrow 文件（ArrowWriter 输出）改名为 {output_dir}/{split}/data-XXXXX-of-XXXXX.arrow，
+    再写 state.json / dataset_info.json / dataset_dict.json，得到与 DatasetDict.save_to_disk 相同的目录，
+    可直接 load_from_disk；不拷贝数据。arrow_paths 中的文件会被移走。
+    """
+    parts = [Dataset.from_file(p) for p in arrow_paths]
+    merged = concatenate_datasets(parts)
+    split_dir = os.path.join(output_dir, split)
+    os.makedirs(split_dir, exist_ok=True)
+    for name in os.listdir(split_dir):  # 上一次构建留下的数据文件
+        if name.startswith("data-") and name.endswith(".arrow"):
+            os.remove(os.path.join(split_dir, name))
+    n = len(arrow_paths)
+    data_files = [f"data-{k:05d}-of-{n:05d}.arrow" for k in range(n)]
+    for src, name in zip(arrow_paths, data_files):
+        os.replace(src, os.path.join(split_dir, name))
+
+    # 与 Dataset.save_to_disk 写出的内容一致
+    state = {key: merged.__dict__[key] for key in
+             ["_fingerprint", "_format_columns", "_format_kwargs", "_format_type", "_output_all_columns"]}
+    state["_split"] = None
+    state["_data_files"] = [{"filename": name} for name in data_files]
+    with open(os.path.join(split_dir, config.DATASET_STATE_JSON_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    info = asdict(merged.info)
+    with open(os.path.join(split_dir, config.DATASET_INFO_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({key: info[key] for key in sorted(info)}, f, indent=2)
+    with open(os.path.join(output_dir, config.DATASETDICT_JSON_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({"splits": [split]}, f)
+    del parts, merged
+
+
+class BuildJournal:
+    """单个 split 的进度日志。"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, JOURNAL_NAME)
+        self.state = None
+
+    def load(self):
+        if os.path.isfile(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        return self.state
+
+    def start(self, fingerprint, shard_size, total_items):
+        self.state = {"fingerprint": fingerprint, "shard_size": shard_size, "total_items": total_items,
+                      "shards": [], "complete": False}
+        self.save()
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+    def record_shard(self, index, start, end, rows):
+        self.state["shards"].append({"index": index, "start": start, "end": end, "rows": rows,
+                                     "file": shard_file_name(index)})
+        self.save()
+
+    def mark_complete(self, rows):
+        self.state["complete"] = True
+        self.state["rows"] = rows
+        self.save()
+
+    def matches(self, fingerprint, shard_size):
+        return (self.state is not None and self.state.get("fingerprint") == fingerprint
+                and self.state.get("shard_size") == shard_size)
+
+    def valid_prefix(self):
+        """校验日志中的分片，返回连续有效的前缀；后面的条目和残留文件都丢弃。"""
+        kept = []
+        shards_root = os.path.join(self.output_dir, SHARDS_DIR)
+        for expected_index, entry in enumerate(self.state.get("shards", [])):
+            name = entry.get("file")
+            shard_path = os.path.join(shards_root, name) if name else None
+            if entry["index"] != expected_index or shard_path is None or not os.path.isfile(shard_path):
+                break
+            try:
+                if Dataset.from_file(shard_path).num_rows != entry["rows"]:
+                    break
+            except Exception:  # 文件不完整
+                break
+            kept.append(entry)
+        self.state["shards"] = kept
+        self.save()
+        keep_files = {e["file"] for e in kept}
+        if os.path.isdir(shards_root):
+            for name in os.listdir(shards_root):
+                if name not in keep_files:
+                    path = os.path.join(shards_root, name)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+        return kept
+
+
+def build_split_checkpointed(items, output_dir, write_shard, shard_size, fingerprint, resume=False):
+    """
+    items: 本 split 的条目（顺序必须确定）
+    write_shard(items_slice, shard_path) -> 写出行数；把分片写成 shard_path 这个 Arrow 文件，
+        写完才出现（先写临时文件再改名）。失败的图片会被跳过，所以行数可能少于条目数。
+    返回最终保存在 output_dir 的 DatasetDict（与 create_local_dataset 的结构相同）。
+    """
+    journal = BuildJournal(output_dir)
+    shards_root = os.path.join(output_dir, SHARDS_DIR)
+
+    if resume and journal.load() is not None and journal.matches(fingerprint, shard_size):
+        if journal.state.get("complete"):
+            try:
+                dataset = load_from_disk(output_dir)
+                print(f"⏭️ 已完成，跳过: {output_dir}")
+                return dataset
+            except Exception:
+                journal.state["complete"] = False
+        done = journal.valid_prefix()
+        print(f"♻️ 续跑 {output_dir}: 保留 {len(done)} 个已完成分片")
+    else:
+        if resume and journal.state is not None:
+            print(f"⚠️ 输入或参数已变化，重新构建: {output_dir}")
+        shutil.rmtree(shards_root, ignore_errors=True)
+        journal.start(fingerprint, shard_size, len(items))
+        done = []
+
+    os.makedirs(shards_root, exist_ok=True)
+    n_shards = (len(items) + shard_size - 1) // shard_size
+    for k in range(len(done), n_shards):
+        start, end = k * shard_size, min((k + 1) * shard_size, len(items))
+        rows = write_shard(items[start:end], os.path.join(shards_root, shard_file_name(k)))
+        journal.record_shard(k, start, end, rows)
+
+    # 分片文件就是最终的数据文件：改名 + 写元数据，不重新编码也不拷贝
+    shards = journal.state["shards"]
+    used = [e for e in shards if e["rows"] > 0] or shards[:1]
+    publish_arrow_files([os.path.join(shards_root, e["file"]) for e in used], output_dir)
+    journal.mark_complete(sum(e["rows"] for e in shards))
+    shutil.rmtree(shards_root, ignore_errors=True)
+    print(f"✅ 数据集已保存到: {output_dir}")
+    return load_from_disk(output_dir)
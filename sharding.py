@@ -0,0 +1,44 @@
+# sharding.py
+# 多机分片执行：按 image_id 的稳定哈希把工作确定性地分到 num_shards 份，
+# 同一张图（及其 aes/ads 两行）总在同一个分片；各节点共享文件系统，最后用 merge_shards.py 合并。
+import os
+import hashlib
+
+
+def shard_of(image_id, num_shards):
+    digest = hashlib.md5(str(image_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def in_shard(image_id, num_shards, shard_index):
+    return num_shards <= 1 or shard_of(image_id, num_shards) == shard_index
+
+
+def add_shard_args(parser):
+    parser.add_argument("--num-shards", type=int, default=1, help="Split the work into this many shards by image_id hash")
+    parser.add_argument("--shard-index", type=int, default=0, help="Which shard this process handles (0-based)")
+
+
+def check_shard_args(args):
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        raise ValueError(f"Invalid shard: --shard-index {args.shard_index} / --num-shards {args.num_shards}")
+
+
+def shard_suffix(num_shards, shard_index):
+    return f"shard-{shard_index:05d}-of-{num_shards:05d}"
+
+
+def shard_output_path(path, num_shards, shard_index):
+    """
+    单文件输出的分片路径：qa_dataset.json → qa_dataset.shard-00000-of-00004.json（扩展名不变）；
+    不分片时原样返回。各节点共享文件系统时不会互相覆盖，之后用 merge_shards.py json 合并。
+    """
+    if num_shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard_suffix(num_shards, shard_index)}{ext}"
+
+
+def shard_quota(total, num_shards, shard_index):
+    """把一个总配额均分给各分片（余数给前面的分片），合起来正好是 total。"""
+    return total // num_shards + (1 if shard_index < total % num_shards else 0)
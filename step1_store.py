@@ -0,0 +1,209 @@
+# step1_store.py
+# 把 step1 目录（每张图一个小 JSON）打包成少量 JSONL 分片 + 按 image_id 的偏移索引，
+# 之后 qa_generation 顺序读分片即可，不再有 ~246k 次 open/parse。
+import os
+import json
+import time
+import argparse
+
+from pipeline_timing import NULL_TIMER
+
+INDEX_NAME = "index.json"
+DEFAULT_RECORDS_PER_SHARD = 50000
+
+
+def shard_name(k):
+    return f"part-{k:05d}.jsonl"
+
+
+def is_packed_store(path):
+    """目录下有 index.json 即视为打包后的 step1 存储。"""
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+class Step1PackWriter:
+    """
+    逐条写入 step1 记录：
+    - 每 records_per_shard 条切换一个 part-XXXXX.jsonl
+    - 记录 image_id -> [shard 序号, 字节偏移, 字节长度]
+    - close() 时写 index.json（先写临时文件再替换）；index.json 存在即表示打包完整
+    - abort()（或 with 块内抛异常）删除已写的分片，不写 index.json，半成品不会被当成打包存储
+    """
+
+    def __init__(self, output_dir, records_per_shard=DEFAULT_RECORDS_PER_SHARD):
+        self.output_dir = output_dir
+        self.records_per_shard = records_per_shard
+        self.shards = []
+        self.records = {}
+        self.count = 0
+        self._out = None
+        self._in_shard = 0
+        os.makedirs(output_dir, exist_ok=True)
+        # 覆盖旧存储时先删旧索引：写到一半崩溃也不会留下指向新分片的旧索引
+        index_path = os.path.join(output_dir, INDEX_NAME)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+
+    def _next_shard(self):
+        if self._out is not None:
+            self._out.close()
+        name = shard_name(len(self.shards))
+        self.shards.append(name)
+        self._out = open(os.path.join(self.output_dir, name), "wb")
+        self._in_shard = 0
+
+    def write(self, record):
+        if self._out is None or self._in_shard >= self.records_per_shard:
+            self._next_shard()
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self.records[record["image_id"]] = [len(self.shards) - 1, self._out.tell(), len(line)]
+        self._out.write(line)
+        self._in_shard += 1
+        self.count += 1
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        index = {"shards": self.shards, "count": self.count, "records": self.records}
+        index_path = os.path.join(self.output_dir, INDEX_NAME)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(index_path + ".tmp", index_path)
+
+    def abort(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        for name in self.shards:
+            path = os.path.join(self.output_dir, name)
+            if os.path.isfile(path):
+                os.remove(path)
+        self.shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def pack_step1_dir(input_dir, output_dir, records_per_shard=DEFAULT_RECORDS_PER_SHARD):
+    """把 input_dir 下所有 *.json 打包到 output_dir，返回记录数。文件名排序保证结果可复现。"""
+    filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".json"))
+    with Step1PackWriter(output_dir, records_per_shard) as writer:
+        for filename in filenames:
+            with open(os.path.join(input_dir, filename), "rb") as f:
+                writer.write(json.loads(f.read()))
+    return writer.count
+
+
+def load_index(packed_dir):
+    with open(os.path.join(packed_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_shard_records(shard_path, timer=NULL_TIMER):
+    """顺序读取单个分片（逐行 json.loads）；timer 开启时分别记录 file_read / json_parse。"""
+    with open(shard_path, "rb") as f:
+        if not timer.enabled:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        while True:
+            t0 = time.perf_counter_ns()
+            line = f.readline()
+            t1 = time.perf_counter_ns()
+            if not line:
+                break
+            timer.add("file_read", t1 - t0)
+            if line.strip():
+                record = json.loads(line)
+                timer.add("json_parse", time.perf_counter_ns() - t1)
+                yield record
+
+
+def select_spans(index, select):
+    """按索引挑出 select(image_id) 为真的记录 → 每个分片一个 [(offset, length), ...]（按偏移排序）。"""
+    spans = [[] for _ in index["shards"]]
+    for image_id, (k, offset, length) in index["records"].items():
+        if select(image_id):
+            spans[k].append((offset, length))
+    for shard_spans in spans:
+        shard_spans.sort()
+    return spans
+
+
+def iter_shard_spans(shard_path, spans, timer=NULL_TIMER):
+    """只读取分片中的指定记录（seek + read），其他行既不读也不解析。"""
+    with open(shard_path, "rb") as f:
+        for offset, length in spans:
+            with timer.stage("file_read"):
+                f.seek(offset)
+                raw = f.read(length)
+            with timer.stage("json_parse"):
+                record = json.loads(raw)
+            yield record
+
+
+def iter_packed_records(packed_dir, timer=NULL_TIMER, select=None):
+    """按分片顺序读取打包存储中的 step1 记录；select(image_id) 非空时按索引只读被选中的记录。"""
+    index = load_index(packed_dir)
+    if select is None:
+        for name in index["shards"]:
+            yield from iter_shard_records(os.path.join(packed_dir, name), timer)
+        return
+    for name, spans in zip(index["shards"], select_spans(index, select)):
+        yield from iter_shard_spans(os.path.join(packed_dir, name), spans, timer)
+
+
+class PackedStep1Store:
+    """按 image_id 随机读取：一次 seek + 一次 read。"""
+
+    def __init__(self, packed_dir):
+        self.packed_dir = packed_dir
+        index = load_index(packed_dir)
+        self.shards = index["shards"]
+        self.records = index["records"]
+        self._handles = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, image_id):
+        return image_id in self.records
+
+    def get(self, image_id, default=None):
+        loc = self.records.get(image_id)
+        if loc is None:
+            return default
+        shard, offset, length = loc
+        f = self._handles.get(shard)
+        if f is None:
+            f = self._handles[shard] = open(os.path.join(self.packed_dir, self.shards[shard]), "rb")
+        f.seek(offset)
+        return json.loads(f.read(length))
+
+    def close(self):
+        for f in self._handles.values():
+            f.close()
+        self._handles.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack per-image step1 JSON files into sharded JSONL with an image_id index.")
+    parser.add_argument("--input-dir", default="step1", help="Directory of per-image step1 JSON files")
+    parser.add_argument("--output-dir", default="step1_packed", help="Output directory for shards + index.json")
+    parser.add_argument("--records-per-shard", type=int, default=DEFAULT_RECORDS_PER_SHARD, help="Records per JSONL shard")
+    args = parser.parse_args()
+
+    n = pack_step1_dir(args.input_dir, args.output_dir, args.records_per_shard)
+    print(f"[OK] 已打包 {n} 条记录 → {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# tensor_store.py
+# 定长图片张量存储：所有输出都是 resize_hw x resize_hw x 3 的 uint8，
+# 直接写进一个或多个 .npy（np.lib.format.open_memmap），训练时 mmap 只读打开，零拷贝随机访问，
+# 多个 DataLoader worker 共享 OS 页缓存，省掉每个样本的 PNG 解码。
+# split 目录结构：
+#   {split}/train/...            QA 列（datasets，save_to_disk），tensor_row 列指向图片所在的全局行
+#   {split}/images-00000.npy     形状 (rows_per_file, hw, hw, 3)，最后一个文件尾部可能未用满
+#   {split}/tensor_store.json    {"resize_hw", "rows", "rows_per_file", "files": [{"name", "rows"}]}
+# merge_shards.py 合并的存储里每个分片的最后一个文件可能未用满，所以按各文件的 rows 定位，不假设每个文件都是 rows_per_file 行。
+import os
+import json
+import shutil
+from bisect import bisect_right
+
+import numpy as np
+from datasets import Dataset, DatasetDict, Features, Value, load_from_disk
+
+from pipeline_timing import NULL_TIMER
+
+STORE_META_NAME = "tensor_store.json"
+DEFAULT_ROWS_PER_FILE = 4096
+
+TENSOR_FEATURES = Features({
+    'id': Value('string'),
+    'problem': Value('string'),
+    'solution': Value('string'),
+    'tensor_row': Value('int64'),
+    'img_height': Value('int64'),
+    'img_width': Value('int64'),
+    'resized_height': Value('int64'),
+    'resized_width': Value('int64')
+})
+
+
+def tensor_file_name(k):
+    return f"images-{k:05d}.npy"
+
+
+def write_tensor_split(examples, output_dir, resize_hw, total=None, rows_per_file=DEFAULT_ROWS_PER_FILE,
+                       timer=NULL_TIMER, features=TENSOR_FEATURES):
+    """
+    examples: iter_split_examples 的输出（'image' 为缩放后的 uint8 数组）
+    total: 条目数上限（用于最后一个文件的容量，避免按 rows_per_file 预留过多）
+    返回 QA 列的 DatasetDict（与 create_local_dataset 结构相同，只是没有 image 列）。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    columns = {name: [] for name in features}
+    files = []
+    current = None
+    filled = 0
+    row = 0
+    for example in examples:
+        if current is None or filled == current.shape[0]:
+            if current is not None:
+                current.flush()
+                del current
+            capacity = rows_per_file if total is None else max(1, min(rows_per_file, total - row))
+            name = tensor_file_name(len(files))
+            current = np.lib.format.open_memmap(os.path.join(output_dir, name), mode="w+", dtype=np.uint8,
+                                                shape=(capacity, resize_hw, resize_hw, 3))
+            files.append({"name": name, "rows": 0})
+            filled = 0
+        with timer.stage("tensor_write"):
+            current[filled] = example['image']
+        filled += 1
+        files[-1]["rows"] = filled
+        example['tensor_row'] = row
+        for name in columns:
+            columns[name].append(example[name])
+        row += 1
+    if current is not None:
+        current.flush()
+        del current
+
+    meta = {"resize_hw": resize_hw, "rows": row, "rows_per_file": rows_per_file, "files": files}
+    with open(os.path.join(output_dir, STORE_META_NAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    with timer.stage("arrow_write"):
+        DatasetDict({'train': Dataset.from_dict(columns, features=features)}).save_to_disk(output_dir)
+    print(f"✅ 张量存储已保存到: {output_dir}（{row} 张, {len(files)} 个 .npy）")
+    return load_from_disk(output_dir)
+
+
+class TensorStore:
+    """
+    只读访问 write_tensor_split 写出的 .npy；memmap 在每个进程里第一次访问时才打开，
+    pickle 时不带 memmap，所以可以直接传给 DataLoader worker。
+    """
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        with open(os.path.join(split_dir, STORE_META_NAME), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # 每个文件的起始全局行号
+        self.starts = []
+        row = 0
+        for e in self.meta["files"]:
+            self.starts.append(row)
+            row += e["rows"]
+        self._arrays = None
+
+    def _open(self):
+        if self._arrays is None:
+            self._arrays = [np.load(os.path.join(self.split_dir, e["name"]), mmap_mode="r")
+                            for e in self.meta["files"]]
+        return self._arrays
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __getitem__(self, row):
+        """返回 (hw, hw, 3) uint8 的只读视图（不拷贝）。"""
+        if not 0 <= row < self.meta["rows"]:
+            raise IndexError(row)
+        k = bisect_right(self.starts, row) - 1
+        return self._open()[k][row - self.starts[k]]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+
+def merge_tensor_stores(split_dirs, output_dir):
+    """
+    合并多个分片的张量存储：.npy 依次拷贝并重新编号，写一个合并后的 tensor_store.json。
+    返回每个输入的全局行偏移（调用方据此给各分片的 tensor_row 加上偏移）。
+    """
+    metas = []
+    for split_dir in split_dirs:
+        with open(os.path.join(split_dir, STORE_META_NAME), "r", encoding="utf-8") as f:
+            metas.append(json.load(f))
+    if len({m["resize_hw"] for m in metas}) > 1:
+        raise ValueError(f"Tensor stores have different resize_hw: {[m['resize_hw'] for m in metas]}")
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    offsets = []
+    row = 0
+    for split_dir, meta in zip(split_dirs, metas):
+        offsets.append(row)
+        for e in meta["files"]:
+            name = tensor_file_name(len(files))
+            shutil.copyfile(os.path.join(split_dir, e["name"]), os.path.join(output_dir, name))
+            files.append({"name": name, "rows": e["rows"]})
+        row += meta["rows"]
+    merged = {"resize_hw": metas[0]["resize_hw"], "rows": row,
+              "rows_per_file": max(m["rows_per_file"] for m in metas), "files": files}
+    with open(os.path.join(output_dir, STORE_META_NAME), "w", encoding="utf-8") as f:
+        json.dump(merged, f, ensure_ascii=False, indent=1)
+    return offsets
+
+
+class TensorImageDataset:
+    """QA 列 + 张量图片的 map-style 数据集，可直接交给 torch DataLoader。"""
+
+    def __init__(self, split_dir):
+        self.rows = load_from_disk(split_dir)['train']
+        self.store = TensorStore(split_dir)
+        # --encode-templates 的数据集：访问时按模板表还原 problem
+        qid = self.rows.features.get('question_id')
+        self.templates = qid.names if qid is not None else None
+
+    def __len__(self):
+        return self.rows.num_rows
+
+    def __getitem__(self, idx):
+        example = self.rows[int(idx)]
+        example['image'] = self.store[example['tensor_row']]
+        if self.templates is not None:
+            example['problem'] = self.templates[example['question_id']]
+        return example
@@ -0,0 +1,148 @@
+# verify_images.py
+# 构建数据集之前并行检查 QA 文件引用的所有图片：是否存在、是否被截断、能否解码。
+# 失败的路径和原因写入持久化的排除列表（按 路径 + mtime 记录），
+# dataset_generation.py / file_copy.py 通过 --bad-list 直接跳过，不用每次构建到一半才发现。
+import os
+import json
+import argparse
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from qa_records import load_qa_records
+
+DEFAULT_BAD_LIST = "bad_images.json"
+
+PNG_END = b"IEND\xaeB`\x82"
+JPEG_END = b"\xff\xd9"
+JPEG_SOS = b"\xff\xda"
+
+
+def _norm(path):
+    return os.path.abspath(str(path))
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+    except OSError:
+        return None, None
+
+
+def check_image(path):
+    """
+    检查单张图片，返回 (path, reason, mtime, size)，reason 为 None 表示正常：
+    - missing / empty / unreadable
+    - truncated: PNG 缺少 IEND 块，JPEG 最后一个扫描段 (SOS, FFDA) 之后没有 EOI (FFD9)
+      （EOI 之后的附加数据允许；EXIF 缩略图自带的 EOI 在主图 SOS 之前，不算数）
+    - decode_failed: cv2.imdecode 返回 None
+    """
+    # 延迟导入：file_copy.py 只用 BadImageList，不需要 cv2
+    import cv2
+    import numpy as np
+
+    mtime, size = _stat(path)
+    if mtime is None:
+        return path, "missing", None, None
+    if size == 0:
+        return path, "empty", mtime, size
+    try:
+        with open(path, "rb") as f:
+            buf = f.read()
+    except OSError as e:
+        return path, f"unreadable: {e.__class__.__name__}", mtime, size
+
+    # cv2 对截断的图常常也能“解码”出来（缺的部分是灰色），所以先看结束标记
+    if buf[:8] == b"\x89PNG\r\n\x1a\n" and buf.rfind(PNG_END) < 0:
+        return path, "truncated", mtime, size
+    if buf[:2] == b"\xff\xd8" and buf.rfind(JPEG_END) < buf.rfind(JPEG_SOS):
+        return path, "truncated", mtime, size
+
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return path, "decode_failed", mtime, size
+    return path, None, mtime, size
+
+
+class BadImageList:
+    """
+    持久化排除列表：{绝对路径: {"mtime", "size", "reason"}}。
+    is_bad() 只在文件 mtime 与记录时一致时才认为仍然是坏图（文件被替换后自动失效）；
+    记录为 missing 的文件只要仍不存在就继续排除。
+    """
+
+    def __init__(self, path=DEFAULT_BAD_LIST):
+        self.path = path
+        self.entries = {}
+        if path and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_bad(self, image_path):
+        if not image_path:
+            return False
+        entry = self.entries.get(_norm(image_path))
+        if entry is None:
+            return False
+        mtime, _ = _stat(image_path)
+        return mtime == entry["mtime"]
+
+    def record(self, image_path, reason, mtime, size):
+        self.entries[_norm(image_path)] = {"mtime": mtime, "size": size, "reason": reason}
+
+    def discard(self, image_path):
+        self.entries.pop(_norm(image_path), None)
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+def verify_paths(paths, bad_list, workers=8, recheck=False):
+    """
+    并行检查 paths，结果写入 bad_list（修好的文件会被移出列表）。
+    recheck=False 时已知坏图（mtime 未变）直接跳过。返回 {reason: 数量}。
+    """
+    todo = [p for p in paths if recheck or not bad_list.is_bad(p)]
+    reasons = {}
+    with Pool(processes=workers) as pool:
+        for path, reason, mtime, size in tqdm(pool.imap_unordered(check_image, todo, chunksize=64),
+                                              total=len(todo), desc="校验图片"):
+            if reason is None:
+                bad_list.discard(path)
+                continue
+            bad_list.record(path, reason, mtime, size)
+            key = reason.split(":")[0]
+            reasons[key] = reasons.get(key, 0) + 1
+    return reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel integrity pre-scan of images referenced by a QA file.")
+    parser.add_argument("--json", required=True, help="QA file (JSON array or JSONL)")
+    parser.add_argument("--bad-list", default=DEFAULT_BAD_LIST, help="Persistent exclusion list (JSON)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Worker processes")
+    parser.add_argument("--recheck", action="store_true", help="Re-verify files already in the bad list")
+    args = parser.parse_args()
+
+    data = load_qa_records(args.json)
+    paths = sorted({fp for fp in data.column("file_path") if fp})
+    bad_list = BadImageList(args.bad_list)
+    reasons = verify_paths(paths, bad_list, workers=args.workers, recheck=args.recheck)
+    bad_list.save()
+
+    print("\n===== Summary =====")
+    print(f"Referenced images: {len(paths)}")
+    for reason, n in sorted(reasons.items(), key=lambda kv: -kv[1]):
+        print(f"❌ {reason}: {n}")
+    print(f"Bad list: {args.bad_list}  (entries: {len(bad_list)})")
+
+
+if __name__ == "__main__":
+    main()